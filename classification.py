@@ -4,8 +4,12 @@ rating bin of skincare products
 """
 import pandas as pd
 import numpy as np
+import os
 import re
+import pickle
+import time
 import data_prep as prep
+import ingredient_ids as ids
 
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score
@@ -20,6 +24,11 @@ from sklearn.ensemble import AdaBoostClassifier
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.model_selection import GridSearchCV
 from sklearn import model_selection
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+
+
+RATING_BINS = ["Very Low", "Low", "Average", "High"]
 
 
 def classification_preprocess(df):
@@ -44,7 +53,7 @@ def classification_preprocess(df):
     # partitions the ratings columns into 4 levels (Very Low, Low, Average, High) 
     bin_column = pd.cut(df['rating'],
        bins=[0, 3.85, 4.25, 4.65, 5.05], 
-       labels=["Very Low", "Low", "Average", "High"])
+       labels=RATING_BINS)
     df = pd.concat([df, bin_column.rename('rating_bin')], axis=1)
     df = df.drop(columns=['rating'])
 
@@ -198,6 +207,10 @@ def adaboost(train_data, k):
     
 
 def test_random_forest(train_data, test_data, min_samples_leaf, max_depth):
+    """
+    Trains the random forest classifier with the given hyperparameters, prints 
+    its test accuracy and returns the fitted model
+    """
     train_labels = train_data['rating_bin']
     train_features = train_data.loc[:, train_data.columns != 'rating_bin']
     test_labels = test_data['rating_bin']
@@ -208,22 +221,213 @@ def test_random_forest(train_data, test_data, min_samples_leaf, max_depth):
     random_tree_model.fit(train_features, train_labels)
     test_score = random_tree_model.score(test_features, test_labels)
     print(test_score)
+    return random_tree_model
+
+
+def save_model(model, file_path):
+    """
+    Pickles the given fitted classifier to the given file path
+    """
+    with open(file_path, 'wb') as model_file:
+        pickle.dump(model, model_file)
+
+
+def load_model(file_path):
+    """
+    Returns the fitted classifier pickled at the given file path
+    """
+    with open(file_path, 'rb') as model_file:
+        return pickle.load(model_file)
+
+
+class IncrementalRatingModel:
+    """
+    Rating bin classifier that is trained one batch of preprocessed data at a 
+    time with partial_fit, so the full feature matrix never has to be in 
+    memory and an existing model can be updated with new products. The 
+    feature columns should be given (see scan_feature_names), otherwise the 
+    first batch fixes them. Brands and categories without a column are 
+    ignored. The skus of the products already trained on (or held out) are 
+    kept in trained_skus, so updates only ingest new products
+    """
+
+    def __init__(self, feature_names=None, random_state=1):
+        self.feature_names = feature_names
+        self.trained_skus = set()
+        self.scaler = StandardScaler()
+        self.model = SGDClassifier(
+            loss='log_loss', alpha=0.001, random_state=random_state)
+
+    def split_batch(self, batch):
+        """
+        Returns the features, aligned to the model's feature columns, and the 
+        labels of the given preprocessed batch
+        """
+        batch = batch[batch['rating_bin'].notna()]
+        features = batch.loc[:, batch.columns != 'rating_bin']
+        if self.feature_names is None:
+            self.feature_names = list(features.columns)
+        features = features.reindex(columns=self.feature_names, fill_value=0)
+        return features.astype(float), batch['rating_bin'].astype(str)
+
+    def partial_fit(self, batch):
+        """
+        Updates the model with the given preprocessed batch
+        """
+        features, labels = self.split_batch(batch)
+        if len(labels) == 0:
+            return self
+        self.scaler.partial_fit(features)
+        self.model.partial_fit(
+            self.scaler.transform(features), labels, classes=RATING_BINS)
+        return self
+
+    def predict(self, features):
+        """
+        Returns the predicted rating bins of the given features
+        """
+        features = features.reindex(columns=self.feature_names, fill_value=0)
+        return self.model.predict(self.scaler.transform(features.astype(float)))
+
+    def count_correct(self, batch):
+        """
+        Returns the number of correctly predicted and total labeled products 
+        in the given preprocessed batch
+        """
+        features, labels = self.split_batch(batch)
+        if len(labels) == 0:
+            return 0, 0
+        correct = (self.predict(features) == labels.to_numpy()).sum()
+        return int(correct), len(labels)
+
+
+def iter_product_chunks(file_path='processed_data.csv', chunk_size=10000,
+                        skip_skus=None):
+    """
+    Yields chunks of at most chunk_size rows of the given processed data file 
+    with one row per sku, without loading the whole file. Skus in skip_skus 
+    or in an earlier chunk are dropped
+    """
+    seen_skus = set() if skip_skus is None else set(skip_skus)
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size):
+        chunk = chunk[~chunk['sku'].isin(seen_skus)].drop_duplicates('sku')
+        seen_skus.update(chunk['sku'])
+        yield chunk
+
+
+def scan_feature_names(file_path='processed_data.csv', chunk_size=10000):
+    """
+    Returns the feature columns of the whole processed data file after 
+    classification_preprocess, in order of first appearance, from a first 
+    pass over the file, so the one-hot brand and category columns of every 
+    chunk are known before training
+    """
+    feature_names = dict()
+    for chunk in iter_product_chunks(file_path, chunk_size):
+        for column in classification_preprocess(chunk).columns:
+            if column != 'rating_bin':
+                feature_names[column] = True
+    return list(feature_names)
+
+
+def is_holdout(skus, holdout_fraction=0.2):
+    """
+    Returns whether each of the given skus is held out for testing. The split 
+    only depends on the sku, so a product stays held out across passes and 
+    model updates
+    """
+    buckets = pd.util.hash_pandas_object(skus, index=False) % 10000
+    return (buckets < holdout_fraction * 10000).to_numpy()
+
+
+def train_incremental(file_path='processed_data.csv', model=None, 
+                      chunk_size=10000, holdout_fraction=0.2):
+    """
+    Trains (or updates, if a model is given) the incremental rating model on 
+    the products of the processed data file it hasn't seen yet, one chunk at 
+    a time, then makes another pass to compute the accuracy on the held out 
+    products. A new model first scans the file for its feature columns. 
+    Returns the model and the holdout accuracy
+    """
+    if model is None:
+        model = IncrementalRatingModel(
+            scan_feature_names(file_path, chunk_size))
+    for chunk in iter_product_chunks(file_path, chunk_size,
+                                     model.trained_skus):
+        train_chunk = chunk[~is_holdout(chunk['sku'], holdout_fraction)]
+        model.partial_fit(classification_preprocess(train_chunk))
+        model.trained_skus.update(chunk['sku'])
+
+    correct, total = 0, 0
+    for chunk in iter_product_chunks(file_path, chunk_size):
+        holdout_chunk = chunk[is_holdout(chunk['sku'], holdout_fraction)]
+        batch_correct, batch_total = model.count_correct(
+            classification_preprocess(holdout_chunk))
+        correct, total = correct + batch_correct, total + batch_total
+
+    return model, correct / max(total, 1)
+
+
+def compare_incremental_model(train_data, test_data, chunk_size=100, 
+                              min_samples_leaf=1, max_depth=28):
+    """
+    Trains the incremental rating model on the training data in batches of 
+    chunk_size and the batch random forest on all of it, and prints the test 
+    accuracy and training time of both
+    """
+    start = time.perf_counter()
+    incremental_model = IncrementalRatingModel(
+        [column for column in train_data.columns if column != 'rating_bin'])
+    for start_row in range(0, len(train_data.index), chunk_size):
+        incremental_model.partial_fit(
+            train_data.iloc[start_row:start_row + chunk_size])
+    incremental_time = time.perf_counter() - start
+    correct, total = incremental_model.count_correct(test_data)
+
+    start = time.perf_counter()
+    train_labels = train_data['rating_bin']
+    train_features = train_data.loc[:, train_data.columns != 'rating_bin']
+    test_labels = test_data['rating_bin']
+    test_features = test_data.loc[:, test_data.columns != 'rating_bin']
+    random_tree_model = RandomForestClassifier(
+        min_samples_leaf=min_samples_leaf, max_depth=max_depth, random_state=1)
+    random_tree_model.fit(train_features, train_labels)
+    forest_time = time.perf_counter() - start
+    forest_score = random_tree_model.score(test_features, test_labels)
+
+    print("Incremental SGD Test Accuracy: ", round(correct / max(total, 1), 4),
+          " | ", "Training Time (s): ", round(incremental_time, 4))
+    print("Random Forest Test Accuracy: ", round(forest_score, 4), 
+          " | ", "Training Time (s): ", round(forest_time, 4), "\n")
+
+
+def incremental_main(file_path='processed_data.csv', 
+                     model_path='rating_model_incremental.pkl'):
+    """
+    Updates the saved incremental rating model with the products of the 
+    processed data file it wasn't trained on yet, or trains a new one if there 
+    is none, and prints its holdout accuracy
+    """
+    model = None
+    if os.path.exists(model_path):
+        model = load_model(model_path)
+    model, holdout_score = train_incremental(file_path, model)
+    save_model(model, model_path)
+    print("Incremental SGD Holdout Accuracy: ", round(holdout_score, 4))
 
 
 def main():
     df = pd.read_csv('skincare_data.csv')
-    # Find skus of products with incomplete ingredients lists with 
-    # cl.find_incomp_ingred_lists(df)
-    df = prep.clean_data(
-        df, incomplete_ingred_skus='incomplete_ingredients_skus.txt')
-    junction_table = prep.create_junction_table(df)
+    # Products with incomplete ingredients lists are quarantined by clean_data
+    # (see non_ingredient_phrases.txt), inspect them with 
+    # prep.find_incomp_ingred_lists(df)
+    ingredient_dict = ids.load_or_create_dictionary('ingredient_ids.json')
     
-    # Add features based on ingredients
-    df['ingredient_counts'] = prep.get_total_ingredient_count(
-        df, junction_table)
-    df = prep.add_contains_ingredient(df)
-    df = prep.add_ingredient_portion(df)
-    #df = prep.add_top_ingredient_count(df, junction_table, top_percentile=0.25)
+    # Clean the data and add features based on ingredients
+    builder = ids.IngredientFeatureBuilder(
+        ingredient_dict, top_percentiles=(0.1, 0.25, 0.5))
+    df, junction_table = builder.build(df)
+    ingredient_dict.save('ingredient_ids.json')
 
     df.to_csv('processed_data.csv', index=None, sep=',')  
     
@@ -240,7 +444,12 @@ def main():
     adaboost(train_data, k=5)
     
     # Test best classifer
-    test_random_forest(train_data, test_data, min_samples_leaf=1, max_depth=28)
+    model = test_random_forest(
+        train_data, test_data, min_samples_leaf=1, max_depth=28)
+    save_model(model, 'rating_model.pkl')
+
+    # Compare with the out-of-core incremental classifier
+    compare_incremental_model(train_data, test_data)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,167 @@
+"""
+Implements an engine that counts how often pairs of ingredients appear in the
+same product, scores the pairs by lift and PMI, and summarizes the ratings of
+the products that contain them, using sparse matrix products over the
+junction table instead of pandas self-merges
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import ingredient_ids as ids
+
+
+class CooccurrenceEngine:
+    """
+    Builds a sparse products x ingredients matrix X from the junction table
+    and the ingredient co-occurrence matrix X.T @ X. Ingredients in fewer than
+    min_support products, and pairs seen together in fewer than min_support
+    products, are dropped. If no ingredient dictionary is given, the 
+    ingredient names are encoded with a new one, ignoring any ingredient_id 
+    column
+    """
+
+    def __init__(self, junction_table, ratings=None, ingredient_dict=None,
+                 min_support=5, min_rating_count=3):
+        if ingredient_dict is None:
+            # ingredient_id columns (ex. from IngredientFeatureBuilder.build) 
+            # refer to a saved dictionary, so re-encode the names instead
+            ingredient_dict = ids.IngredientDictionary()
+            junction_table = junction_table.drop(
+                columns=['ingredient_id'], errors='ignore')
+        self.ingredient_dict = ingredient_dict
+        self.min_support = min_support
+
+        if 'ingredient_id' not in junction_table.columns:
+            junction_table = ids.add_ingredient_ids(
+                junction_table.copy(), ingredient_dict)
+        elif junction_table['ingredient_id'].max() >= len(ingredient_dict):
+            raise ValueError('the junction table has ingredient IDs that '
+                             'are not in the given ingredient dictionary')
+        junction_table = junction_table[junction_table['ingredient_id'] >= 0]
+
+        rows, self.skus = pd.factorize(junction_table['sku'])
+        columns = junction_table['ingredient_id'].to_numpy()
+        self.n_products = len(self.skus)
+
+        # keep only ingredients that reach min_support, so the co-occurrence
+        # matrix is at most (frequent ingredients)^2
+        X = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+            shape=(self.n_products, len(ingredient_dict)))
+        X.data[:] = 1   # an ingredient listed twice counts once
+        support = np.asarray(X.sum(axis=0)).ravel()
+        self.ingredient_ids = np.flatnonzero(support >= min_support)
+        self.support = support[self.ingredient_ids]
+        self.column_of = {ingredient_id: column for column, ingredient_id
+                          in enumerate(self.ingredient_ids)}
+        self.X = X.tocsc()[:, self.ingredient_ids].tocsr()
+        self.X_csc = self.X.tocsc()
+
+        counts = (self.X.T @ self.X).tocsr()
+        counts.data[counts.data < min_support] = 0
+        counts.eliminate_zeros()
+        self.counts = counts
+
+        self.set_ratings(ratings, min_rating_count)
+
+    def set_ratings(self, ratings, min_rating_count=3):
+        """
+        Aligns a dataframe with sku, rating and rating_count columns to the
+        products of the engine. Only products with at least min_rating_count
+        ratings are used for rating statistics
+        """
+        self.rating = np.full(self.n_products, np.nan)
+        if ratings is not None:
+            ratings = ratings.drop_duplicates('sku').set_index('sku')
+            ratings = ratings.reindex(self.skus)
+            is_rated = ratings['rating_count'].to_numpy() >= min_rating_count
+            self.rating = np.where(
+                is_rated, ratings['rating'].to_numpy(dtype=float), np.nan)
+
+    def name(self, column):
+        """
+        Returns the canonical name of the ingredient in the given column
+        """
+        return self.ingredient_dict.names[self.ingredient_ids[column]]
+
+    def find_column(self, ingredient):
+        """
+        Returns the column of the given ingredient name, raising a KeyError if
+        it is unknown or below min_support
+        """
+        ingredient_id = self.ingredient_dict.get_id(ingredient, add=False)
+        if ingredient_id not in self.column_of:
+            raise KeyError(ingredient + ' is unknown or in fewer than '
+                           + str(self.min_support) + ' products')
+        return self.column_of[ingredient_id]
+
+    def score_pairs(self, counts, support_a, support_b):
+        """
+        Returns the lift and PMI of pairs given their co-occurrence counts and
+        the support of each ingredient of the pair
+        """
+        lift = (np.asarray(counts, dtype=float) * self.n_products
+                / (np.asarray(support_a, dtype=float) * support_b))
+        return lift, np.log(lift)
+
+    def pair_table(self):
+        """
+        Returns a dataframe with the count, lift and PMI of every ingredient
+        pair that reaches min_support
+        """
+        pairs = sparse.triu(self.counts, k=1).tocoo()
+        lift, pmi = self.score_pairs(
+            pairs.data, self.support[pairs.row], self.support[pairs.col])
+        names = np.array(
+            [self.name(column) for column in range(len(self.ingredient_ids))],
+            dtype=object)
+        return pd.DataFrame({
+            'ingredient_a': names[pairs.row], 'ingredient_b': names[pairs.col],
+            'count': pairs.data, 'lift': lift, 'pmi': pmi})
+
+    def rating_stats(self, column):
+        """
+        Returns the number of rated products, mean rating and rating standard
+        deviation of the products containing the ingredient in the given
+        column together with each other ingredient, as arrays over columns
+        """
+        products = self.X_csc[:, column].indices
+        with_ingredient = self.X[products]
+        ratings = self.rating[products]
+        is_rated = ~np.isnan(ratings)
+        ratings = np.where(is_rated, ratings, 0.0)
+
+        rated_count = with_ingredient.T @ is_rated.astype(float)
+        rating_sum = with_ingredient.T @ ratings
+        rating_squares = with_ingredient.T @ (ratings ** 2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = rating_sum / rated_count
+            variance = rating_squares / rated_count - mean ** 2
+        return rated_count, mean, np.sqrt(np.clip(variance, 0, None))
+
+    def top_k(self, ingredient, k=10, by='count'):
+        """
+        Returns a dataframe of the k ingredients that appear with the given
+        ingredient most often (by='count') or most strongly (by='lift' or
+        'pmi'), with the ratings of the products that contain both
+        ex. engine.top_k('niacinamide', k=10)
+        """
+        column = self.find_column(ingredient)
+        row = self.counts.getrow(column)
+        is_other = row.indices != column
+        others, counts = row.indices[is_other], row.data[is_other]
+        lift, pmi = self.score_pairs(
+            counts, self.support[column], self.support[others])
+
+        top = pd.DataFrame({
+            'ingredient': [self.name(other) for other in others],
+            'count': counts, 'lift': lift, 'pmi': pmi})
+        rated_count, mean, std = self.rating_stats(column)
+        top['rated_count'] = rated_count[others].astype(int)
+        top['mean_rating'] = mean[others]
+        top['rating_std'] = std[others]
+        top['base_mean_rating'] = mean[column]
+
+        top = top.sort_values(by, ascending=False, kind='mergesort').head(k)
+        return top.reset_index(drop=True)
@@ -7,30 +7,100 @@ import numpy as np
 import re
 
 
-def clean_ingredients(df, file_path = None):
+def compile_bad_phrases(file_path):
+    """
+    Returns a list of compiled, case-insensitive regexes for the undesirable 
+    phrases in the given text file, in file order, so they can be reused 
+    across calls without re-reading the file
+    Note: each phrase should be on a new line
+    """
+    with open(file_path) as bad_substrings:
+        return [re.compile(re.escape(string.strip()), flags=re.I)
+                for string in bad_substrings.readlines()]
+
+
+# literal fixes to specific scraped ingredients lists, applied by clean_data
+INGREDIENTS_FIXES = [
+    ('Citrus Aurantium Dulcis (Orange) Flower Oil  Farnesol',
+     'Citrus Aurantium Dulcis (Orange) Flower Oil, Farnesol'),
+    ('Water, Eau', 'Water/Eau'),
+    ('1, 2', '1,2'),
+    (',000ppm', '000ppm'),
+    # Certain products has dash seperated ingredients lists
+    (' - ', ', '),
+]
+
+
+def literal_guard(regex):
+    """
+    Returns the lower case text of an ASCII phrase that a case-insensitive 
+    regex (as compiled by compile_bad_phrases) matches literally, or None for 
+    other regexes. An ASCII string can only match such a regex if its lower 
+    case contains the guard
+    """
+    literal = re.sub(r'\\(.)', r'\1', regex.pattern, flags=re.S)
+    if (not regex.flags & re.I or not literal.isascii()
+            or re.escape(literal) != regex.pattern):
+        return None
+    return literal.lower()
+
+
+def compile_cleaning_rules(bad_phrases=None, fixes=()):
+    """
+    Returns the list of (rule, replacement, guard) triples clean_ingredients 
+    applies: the given compiled undesirable phrases, the special characters 
+    not used in ingredients lists, then the given literal (old, new) fixes. 
+    Literal rules are kept as strings for str.replace, and phrase regexes 
+    get a literal_guard so they are only run on strings that may match them
+    """
+    rules = [(regex, '', literal_guard(regex)) for regex in bad_phrases or []]
+    special_char = ['*', '"', '.', '[', ']', '\\n', '\\r']
+    rules.extend((char, '', None) for char in special_char)
+    rules.extend((old, new, None) for old, new in fixes)
+    return rules
+
+
+def clean_ingredients_text(text, rules):
+    """
+    Returns the given ingredients string with each of the rules of 
+    compile_cleaning_rules applied in order
+    """
+    lowered = None
+    for rule, replacement, guard in rules:
+        if guard is not None:
+            if lowered is None:
+                # re.I only matches other letters than lower() does outside 
+                # ASCII (ex. 'ı' matches 'i'), so only guard ASCII strings
+                lowered = text.lower() if text.isascii() else ''
+            if lowered and guard not in lowered:
+                continue
+        if isinstance(rule, str):
+            text = text.replace(rule, replacement)
+        else:
+            text = rule.sub(replacement, text)
+        lowered = None
+    return text
+
+
+def clean_ingredients(df, file_path = None, bad_phrases=None, rules=None):
     """
     Returns a new dataframe with special characters that don't belong in 
     ingredient names removed. Also removes undesirable phrases that were 
     scraped along with the ingredients lists, given a text file of 
-    undesireable phrases
+    undesireable phrases or the phrases already compiled with 
+    compile_bad_phrases. All the replacements are made in one pass over each 
+    ingredients string, and rules already compiled with 
+    compile_cleaning_rules can be given instead
     Note: each phrase should be on a new line
     """
-    clean_ingredients =  df['ingredients']
-
-    # removes undesirable phrases (ex. organic ingredients)
-    if file_path is not None:
-        with open(file_path) as bad_substrings:
-            for string in bad_substrings.readlines():
-                regex = r'' + re.escape(string.strip())
-                clean_ingredients = clean_ingredients.str.replace(
-                    regex, '', regex=True, case=False)
-    
-    # remove special characters not used in ingredients lists
-    special_char = ['*', '"', '.', '[', ']', '\\n', '\\r']
-    for char in special_char:
-        clean_ingredients = clean_ingredients.str.replace(char, '')
+    if rules is None:
+        # removes undesirable phrases (ex. organic ingredients)
+        if bad_phrases is None and file_path is not None:
+            bad_phrases = compile_bad_phrases(file_path)
+        rules = compile_cleaning_rules(bad_phrases)
 
-    df['ingredients'] = clean_ingredients
+    df['ingredients'] = df['ingredients'].map(
+        lambda text: clean_ingredients_text(text, rules), na_action='ignore')
 
     return df
 
@@ -51,109 +121,185 @@ def list_strip(strings):
     return stripped
 
 
-def find_incomp_ingred_lists(df):
+def compile_rule_phrases(file_path):
+    """
+    Returns a single compiled, case-insensitive regex matching any of the 
+    regexes in the given text file
+    Note: each regex should be on a new line
+    """
+    with open(file_path) as rules:
+        phrases = [rule.strip() for rule in rules.readlines() if rule.strip()]
+    return re.compile('|'.join('(?:' + phrase + ')' for phrase in phrases),
+                      flags=re.I)
+
+
+def validate_ingredient_lists(df, rule_phrases='non_ingredient_phrases.txt',
+                              max_single_ingredient_length=50,
+                              max_mean_token_length=100):
     """
-    Creates a .txt file containing the sku and ingredients lists of products 
-    that seem to have incomplete ingredients lists (lack of comma)
+    Scores every product's ingredients list at once and returns a dataframe 
+    with the same index as df containing the comma count, token count and mean 
+    token length of each list, a boolean quarantine column for lists that seem 
+    incomplete, and the ';' seperated reasons why. rule_phrases is a text file 
+    of non-ingredient phrase regexes or a regex compiled with 
+    compile_rule_phrases
     """
-    df['ingredients'] = df['ingredients'].str.replace('1,2', '1.2')
+    if isinstance(rule_phrases, str):
+        rule_phrases = compile_rule_phrases(rule_phrases)
+    ingredients = df['ingredients'].fillna('')
+
+    # 1,2-Hexanediol and 2,3-Butanediol don't seperate ingredients
+    fixed_comma = ingredients.str.replace('1,2', '12', regex=False)
+    fixed_comma = fixed_comma.str.replace('2,3', '23', regex=False)
+    tokens = fixed_comma.str.split(',').explode().str.strip()
+    tokens = tokens[tokens != '']
+    token_lengths = tokens.str.len().groupby(level=0)
+
+    report = pd.DataFrame(index=df.index)
+    report['comma_count'] = fixed_comma.str.count(',')
+    report['token_count'] = token_lengths.size().reindex(
+        df.index, fill_value=0)
+    report['mean_token_length'] = token_lengths.mean().reindex(
+        df.index, fill_value=0.0)
+
+    checks = {
+        'empty': report['token_count'] == 0,
+        'missing_commas': (report['comma_count'] == 0) & (
+            report['mean_token_length'] > max_single_ingredient_length),
+        'long_tokens': report['mean_token_length'] > max_mean_token_length,
+        'non_ingredient_phrase': ingredients.str.contains(rule_phrases),
+    }
+    reasons = pd.Series('', index=df.index)
+    for reason, failed in checks.items():
+        reasons = reasons.mask(failed, reasons + reason + ';')
+
+    report['quarantine'] = reasons != ''
+    report['reasons'] = reasons.str.rstrip(';')
+    return report
 
-    filtered_df = df[~df['ingredients'].str.contains(',', na=False)]
-    sku_ingredients = filtered_df.loc[:,['sku', 'ingredients']]
-    sku_ingredients.to_csv('incomplete_ingredients.txt', 
+
+def find_incomp_ingred_lists(df):
+    """
+    Creates a .txt file containing the sku, ingredients lists and reasons of 
+    products that seem to have incomplete ingredients lists
+    """
+    report = validate_ingredient_lists(df)
+    quarantined = df.loc[report['quarantine'], ['sku', 'ingredients']].copy()
+    quarantined['reasons'] = report.loc[report['quarantine'], 'reasons']
+    quarantined.to_csv('incomplete_ingredients.txt', 
         header=None, index=None, sep=',')
 
 
+def split_ingredients_text(text):
+    """
+    Returns the given ingredients string split into a list of stripped 
+    ingredient names, keeping 1,2-Hexanediol and 2,3-Butanediol intact
+    """
+    # rename 1,2-Hexanediol, 2,3-Butanediol without comma
+    fixed_comma = text.replace('1,2', 'placeholder1')
+    fixed_comma = fixed_comma.replace('2,3', 'placeholder2')
+    seperated_ingred = list_strip(fixed_comma.split(','))
+    seperated_ingred = list_replace(seperated_ingred, 'placeholder1', '1,2')
+    return list_replace(seperated_ingred, 'placeholder2', '2,3')
+
+
+def split_ingredients(df):
+    """
+    Returns a series with each product's ingredients string split into a list 
+    of stripped ingredient names, keeping 1,2-Hexanediol and 2,3-Butanediol 
+    intact
+    """
+    return df['ingredients'].map(split_ingredients_text, na_action='ignore')
+
+
 def create_junction_table(df):
     """
     Creates and returns junction table of ingredients, with each product's sku 
-    as the key
+    as the key. Only the first row of a sku is used, and each product's 
+    ingredients keep their list order
     """
-    # rename 1,2-Hexanediol, 2,3-Butanediol without comma
-    fixed_comma = df['ingredients'].str.replace('1,2', 'placeholder1')
-    fixed_comma = fixed_comma.str.replace('2,3', 'placeholder2')
-    seperated_ingred = fixed_comma.str.split(',').apply(list_strip)
-    seperated_ingred = seperated_ingred.apply(list_replace, args=('placeholder1', '1,2'))
-    seperated_ingred = seperated_ingred.apply(list_replace, args=('placeholder2', '2,3'))
-    
-    junction_table = []
-    products_added = set()
-    df = df.reset_index(drop=True)
-    for i in range(len(df.index)):
-        product = df.loc[i]
-        if product['sku'] not in products_added:
-            ingredients_list = seperated_ingred.iloc[i]
-            for j in range(len(ingredients_list)):
-                new_row = [product['sku'], ingredients_list[j]]
-                junction_table.append(new_row)
-            products_added.add(product['sku'])
-    
-    junction_table = pd.DataFrame(junction_table)
-    junction_table.columns = ['sku', 'ingredient']
+    df = df.drop_duplicates(subset='sku')
+    junction_table = pd.DataFrame({
+        'sku': df['sku'].to_numpy(),
+        'ingredient': split_ingredients(df).to_numpy()})
+    junction_table = junction_table.explode('ingredient', ignore_index=True)
 
     # drop empty rows
-    junction_table['ingredient'].replace('', np.nan, inplace=True)
+    junction_table['ingredient'] = junction_table['ingredient'].replace(
+        '', np.nan)
     junction_table.dropna(subset=['ingredient'], inplace=True)
 
-    return junction_table
+    return junction_table.reset_index(drop=True)
 
 
 def find_unique_skus(df):
     """
-    Returns list of skus of skincare products that appear in the data only once
+    Returns list of the distinct skus of skincare products, keeping only one 
+    of the rows of products listed under several (sub)categories
     """
-    unique_df = df.drop_duplicates(subset=list(df.columns).remove('category'))
+    unique_df = df.drop_duplicates(subset='sku')
     unique_skus = list(unique_df['sku'])
     return unique_skus
 
 
+def analyze_duplicated_skus(df):
+    """
+    Returns a tuple of two dataframes built from a single groupby over the 
+    skus. The first has the name, list of subcategories and row count of every 
+    duplicated sku, the second has the first row of every distinct sku
+    """
+    grouped = df.groupby('sku', sort=False)
+    sku_summary = grouped.agg(
+        product_name=('product_name', 'first'),
+        subcategories=('subcategory', list),
+        row_count=('subcategory', 'size'))
+    duplicated_products = sku_summary[sku_summary['row_count'] > 1]
+    duplicated_products = duplicated_products.reset_index()
+    duplicated_products = duplicated_products[
+        ['product_name', 'sku', 'subcategories', 'row_count']]
+
+    unique_products = grouped.head(1).reset_index(drop=True)
+
+    return duplicated_products, unique_products
+
+
 def find_duplicated_skus(df):
     """
     Creates a .txt file containing the names, skus, and categories of products 
-    that are duplicated
-    """
-    is_duplicated = df['sku'].duplicated(keep=False)
-    filtered_df = df[is_duplicated]
-    duplicated_skus = set(filtered_df['sku'])
-
-    duplicated_rows = []
-    for sku in duplicated_skus:
-        product_rows = filtered_df[filtered_df['sku'] == sku]
-        product_rows = product_rows.reset_index(drop=True)
-        product_name = product_rows['product_name'][0]
-        categories = list(product_rows['subcategory'])
-        duplicated_rows.append([product_name, sku, categories])
-        
-    duplicated_products = pd.DataFrame(duplicated_rows)
-    duplicated_products.to_csv('duplicated_products.txt', 
-        header=None, index=None, sep=':')
-
-
-def clean_data(data, incomplete_ingred_skus=None):
-    """
-    Clean the ingredients lists of products and drop products given a text file 
-    of skus of products that have incompelte ingredient lists
-    """
-    cleaned_ingred = clean_ingredients(data, file_path='not_ingredients.txt')
-
-    cleaned_ingred['ingredients'] = cleaned_ingred['ingredients'].str.replace(
-        'Citrus Aurantium Dulcis (Orange) Flower Oil  Farnesol', 
-        'Citrus Aurantium Dulcis (Orange) Flower Oil, Farnesol', regex=False)
-    cleaned_ingred['ingredients'] = cleaned_ingred['ingredients'].str.replace(
-        'Water, Eau', 'Water/Eau', regex=False)
-    cleaned_ingred['ingredients'] = cleaned_ingred['ingredients'].str.replace(
-        '1, 2', '1,2', regex=False)
-    cleaned_ingred['ingredients'] = cleaned_ingred['ingredients'].str.replace(
-        ',000ppm', '000ppm', regex=False)
+    that are duplicated and returns the duplicated products as a dataframe
+    """
+    duplicated_products, _ = analyze_duplicated_skus(df)
+    duplicated_products[['product_name', 'sku', 'subcategories']].to_csv(
+        'duplicated_products.txt', header=None, index=None, sep=':')
+    return duplicated_products
+
+
+def clean_data(data, incomplete_ingred_skus=None, bad_phrases=None,
+               quarantine=True, rule_phrases='non_ingredient_phrases.txt',
+               cleaning_rules=None):
+    """
+    Clean the ingredients lists of products and drop products whose ingredient 
+    lists validate_ingredient_lists quarantines, as well as products given a 
+    text file of skus of products that have incompelte ingredient lists. The 
+    undesirable phrases are read from not_ingredients.txt unless already 
+    compiled ones are given, and the quarantine rule_phrases can likewise be a 
+    regex already compiled with compile_rule_phrases. Streaming callers can 
+    pass all the replacements precompiled as cleaning_rules, built with 
+    compile_cleaning_rules(bad_phrases, INGREDIENTS_FIXES)
+    """
+    if cleaning_rules is None:
+        if bad_phrases is None:
+            bad_phrases = compile_bad_phrases('not_ingredients.txt')
+        cleaning_rules = compile_cleaning_rules(bad_phrases, INGREDIENTS_FIXES)
+    cleaned_ingred = clean_ingredients(data, rules=cleaning_rules)
 
-    # Certain products has dash seperated ingredients lists
-    cleaned_ingred['ingredients'] = cleaned_ingred['ingredients'].str.replace(
-        ' - ', ', ')
-    
     # Drop products with incomplete ingredients lists
+    if quarantine:
+        report = validate_ingredient_lists(cleaned_ingred, rule_phrases)
+        cleaned_ingred = cleaned_ingred.loc[~report['quarantine']]
     if incomplete_ingred_skus is not None:
         with open(incomplete_ingred_skus) as skus:
-            bad_skus = [sku.strip() for sku in skus.readlines()]
+            bad_skus = {sku.strip() for sku in skus.readlines()}
             cleaned_ingred = cleaned_ingred.loc[~cleaned_ingred['sku'].isin(bad_skus)]
 
     return cleaned_ingred.reset_index(drop=True)
@@ -247,24 +393,39 @@ def get_ingredient_count(df, ingredient, group=None):
     return ingredient_count
 
 
-def add_contains_ingredient(df):
+def make_contains_columns_dict():
     """
-    Add boolean columns indicating whether the skincare product contains a 
-    important ingredient and returns the dataframe
+    Returns a dict with the name of each contains_ column added by 
+    add_contains_ingredient as keys, and the ingredient and its aliases (if 
+    it is a group) as values
     """
+    contains_columns = dict()
+
     # Single ingredients
     single_ingredients = ['niacinamide', 'azelaic acid', 'urea', 'retinol']
     for ingredient in single_ingredients:
-        contains_ingredient = get_contains_ingredient(df, ingredient)
         column_name = str('contains_' + ingredient.lower().replace(' ', '_'))
-        df = pd.concat([df, contains_ingredient.rename(column_name)], axis=1)
+        contains_columns[column_name] = [ingredient]
 
     # Group of ingredients
     ingredient_groups = make_ingredients_group_dict()
     for ingredient in ingredient_groups.keys():
-        contains_ingredient = get_contains_ingredient(
-            df, ingredient, ingredient_groups[ingredient])
         column_name = str('contains_' + ingredient.lower().replace(' ', '_'))
+        contains_columns[column_name] = (
+            [ingredient] + ingredient_groups[ingredient])
+
+    return contains_columns
+
+
+def add_contains_ingredient(df):
+    """
+    Add boolean columns indicating whether the skincare product contains a 
+    important ingredient and returns the dataframe
+    """
+    contains_columns = make_contains_columns_dict()
+    for column_name, ingredients in contains_columns.items():
+        contains_ingredient = get_contains_ingredient(
+            df, ingredients[0], ingredients[1:] or None)
         df = pd.concat([df, contains_ingredient.rename(column_name)], axis=1)
 
     return df
@@ -304,32 +465,109 @@ def get_total_ingredient_count(df, junction_table):
     return counts
 
 
-def add_top_ingredient_count(df, junction_table, top_percentile=0.5):
-    quantile_ingredients = []
-    for sku in df['sku']:
-        sku_ingredients = junction_table[junction_table['sku'].str.match(sku)]
-        index = round(len(sku_ingredients.index) * top_percentile)
-        sku_ingredients.drop(sku_ingredients.index[:index])
-
-        ingredients = ','.join(list(sku_ingredients['ingredient']))
-        quantile_ingredients.append([sku, ingredients])
-        
-    quantile_ingredients = pd.DataFrame(quantile_ingredients)
-    quantile_ingredients.columns = ['sku', 'ingredients']
-    
+def make_star_ingredients_list():
+    """
+    Returns a list of the important ingredients counted by 
+    add_ingredient_portion and the top ingredient features, with the aliases 
+    of the ingredient groups
+    """
     # Single Ingredients
-    single_ingredients = ['niacinamide', 'azelaic acid', 'retinol']
-    star_ingredients = np.zeros(len(df))
-    for ingredient in single_ingredients:
-        star_ingredients = star_ingredients + get_ingredient_count(
-            quantile_ingredients, ingredient)
+    star_patterns = ['niacinamide', 'azelaic acid', 'retinol']
 
     # Group of ingredients
     ingredient_groups = make_ingredients_group_dict()
     for ingredient in ingredient_groups.keys():
-         star_ingredients = star_ingredients + get_ingredient_count(
-            quantile_ingredients, ingredient, ingredient_groups[ingredient])
-    
-    df['top_ingredient_count'] = star_ingredients.astype(int)
+        star_patterns = (
+            star_patterns + [ingredient] + ingredient_groups[ingredient])
+    return star_patterns
+
+
+def get_top_ingredient_features(junction_table,
+                                top_percentiles=(0.1, 0.25, 0.5),
+                                is_star=None):
+    """
+    Returns a dataframe indexed by sku with, for each top percentile, the 
+    number of important ingredients in that top portion of the product's 
+    ingredients list, and the 1-based position (0 if none) and relative 
+    position (1.0 if none) of the first important ingredient. Ingredient order 
+    approximates concentration. Assumes the junction table lists each 
+    product's ingredients in order, as create_junction_table does. is_star 
+    can give whether each junction table row is an important ingredient
+    """
+    if is_star is None:
+        # match the patterns against each distinct ingredient name only once
+        names = pd.Series(junction_table['ingredient'].unique())
+        star_names = set(names[names.str.contains(
+            '|'.join(make_star_ingredients_list()), case=False, na=False)])
+        is_star = junction_table['ingredient'].isin(star_names)
+
+    codes, skus = pd.factorize(junction_table['sku'])
+    features = top_ingredient_arrays(codes, len(skus), is_star, top_percentiles)
+    return pd.DataFrame(features, index=pd.Index(skus, name='sku'))
+
+
+def top_ingredient_arrays(codes, n_products, is_star,
+                          top_percentiles=(0.1, 0.25, 0.5)):
+    """
+    Returns a dict of the columns of get_top_ingredient_features as arrays 
+    over products, given the product number of each ingredient row (in list 
+    order) and whether each row is an important ingredient. Products without 
+    rows get no important ingredients
+    """
+    codes = np.asarray(codes)
+    is_star = np.asarray(is_star, dtype=bool)
+
+    # position of each row within its product's list, without assuming the 
+    # rows of a product are contiguous
+    order = np.argsort(codes, kind='stable')
+    lengths = np.bincount(codes, minlength=n_products)
+    starts = np.cumsum(lengths) - lengths
+    position = np.empty(len(codes), dtype=np.int64)
+    position[order] = np.arange(len(codes)) - starts[codes[order]]
+    length = lengths[codes]
+
+    features = dict()
+    for top_percentile in top_percentiles:
+        column_name = 'top_' + str(round(top_percentile * 100)) + '_star_count'
+        in_top = position < np.round(length * top_percentile)
+        features[column_name] = np.bincount(
+            codes[is_star & in_top], minlength=n_products)
+
+    first_star = np.full(n_products, np.inf)
+    np.minimum.at(first_star, codes[is_star], position[is_star])
+    has_star = np.isfinite(first_star)
+    features['first_star_relative_position'] = np.where(
+        has_star, first_star / np.maximum(lengths, 1), 1.0)
+    features['first_star_position'] = np.where(
+        has_star, first_star + 1, 0).astype(int)
+    return features
+
+
+def add_top_ingredient_features(df, junction_table,
+                                top_percentiles=(0.1, 0.25, 0.5),
+                                is_star=None):
+    """
+    Adds the columns of get_top_ingredient_features to the dataframe, matched 
+    by sku, and returns the new df
+    """
+    features = get_top_ingredient_features(
+        junction_table, top_percentiles, is_star)
+    no_ingredients = {column: 0 for column in features.columns}
+    no_ingredients['first_star_relative_position'] = 1.0
+    features = features.reindex(df['sku']).fillna(no_ingredients)
+    features = features.astype({column: int for column in features.columns 
+                                if column != 'first_star_relative_position'})
+    features.index = df.index
+    return pd.concat([df, features], axis=1)
+
+
+def add_top_ingredient_count(df, junction_table, top_percentile=0.5):
+    """
+    Adds a column counting the important ingredients in the top percentile of 
+    each product's ingredients list and returns the dataframe
+    """
+    features = get_top_ingredient_features(junction_table, [top_percentile])
+    top_counts = df['sku'].map(features.iloc[:, 0]).fillna(0)
+    df['top_ingredient_count'] = top_counts.astype(int)
 
     return df
@@ -0,0 +1,188 @@
+"""
+Tests whether products containing popular ingredients (the contains_ columns
+added by data_prep.add_contains_ingredient) have higher ratings, with
+stratified bootstrap confidence intervals and permutation p-values of the
+difference in mean rating. Resamples are drawn with NumPy for all products
+at once and sharded across processes
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def get_effect_inputs(df, min_rating_count=3, weighted=False):
+    """
+    Returns the ratings, weights, flag matrix and flag column names of the
+    products with at least min_rating_count ratings. Weights are the
+    rating counts if weighted is True and all ones otherwise
+    """
+    rated = df[df['rating_count'] >= min_rating_count]
+    flag_names = [column for column in rated.columns
+                  if column.startswith('contains_')]
+    ratings = rated['rating'].to_numpy(dtype=float)
+    if weighted:
+        weights = rated['rating_count'].to_numpy(dtype=float)
+    else:
+        weights = np.ones(len(ratings))
+    flags = rated[flag_names].to_numpy(dtype=float)
+    return ratings, weights, flags, flag_names
+
+
+def mean_differences(weighted_ratings, weights, flags):
+    """
+    Returns the (weighted) mean rating of products with each flag minus that
+    of products without it, for each row of per-product weighted ratings and
+    weights. Flags no product (or every product) has give NaN
+    """
+    with_sum = weighted_ratings @ flags
+    with_weight = weights @ flags
+    without_sum = weighted_ratings.sum(axis=-1, keepdims=True) - with_sum
+    without_weight = weights.sum(axis=-1, keepdims=True) - with_weight
+    with np.errstate(invalid='ignore', divide='ignore'):
+        differences = with_sum / with_weight - without_sum / without_weight
+    return np.where((with_weight > 0) & (without_weight > 0),
+                    differences, np.nan)
+
+
+def bootstrap_chunk(random, ratings, weights, flags, n_resamples):
+    """
+    Returns the mean differences of n_resamples stratified bootstrap 
+    resamples: for each flag, the products with and without it are resampled 
+    separately with their own sizes, so every resample has both groups. Each 
+    group's draw counts come from one multinomial over all resamples
+    """
+    differences = np.full((n_resamples, flags.shape[1]), np.nan)
+    for j in range(flags.shape[1]):
+        has_flag = flags[:, j] > 0
+        group_means = []
+        for group in (has_flag, ~has_flag):
+            n_group = int(group.sum())
+            if n_group == 0:
+                break
+            draws = random.multinomial(
+                n_group, np.full(n_group, 1 / n_group), size=n_resamples)
+            group_weights = draws * weights[group]
+            group_means.append(group_weights @ ratings[group]
+                               / group_weights.sum(axis=1))
+        else:
+            differences[:, j] = group_means[0] - group_means[1]
+    return differences
+
+
+def permutation_chunk(random, ratings, weights, flags, n_resamples):
+    """
+    Returns the mean differences of n_resamples permutations of the ratings
+    (and their weights) over the products
+    """
+    n_products = len(ratings)
+    index = np.argsort(random.random((n_resamples, n_products)), axis=1)
+    permuted_weights = weights[index]
+    return mean_differences(
+        permuted_weights * ratings[index], permuted_weights, flags)
+
+
+def run_shard(kind, seed, ratings, weights, flags, n_resamples, chunk_size):
+    """
+    Returns the mean differences of n_resamples bootstrap or permutation
+    resamples, computed chunk_size resamples at a time to bound memory
+    """
+    resample_chunk = {'bootstrap': bootstrap_chunk,
+                      'permutation': permutation_chunk}[kind]
+    random = np.random.default_rng(seed)
+    differences = []
+    for start in range(0, n_resamples, chunk_size):
+        differences.append(resample_chunk(
+            random, ratings, weights, flags,
+            min(chunk_size, n_resamples - start)))
+    return np.concatenate(differences)
+
+
+def resample_differences(kind, ratings, weights, flags, n_resamples, seed=0,
+                         n_jobs=None, max_chunk_values=5000000):
+    """
+    Returns an (n_resamples x flags) array of mean differences from bootstrap
+    or permutation resamples, split into one shard per process with
+    independent seeds
+    """
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = max(1, min(n_jobs, n_resamples))
+    chunk_size = max(1, max_chunk_values // max(len(ratings), 1))
+    seeds = np.random.SeedSequence(seed).spawn(n_jobs)
+    shard_sizes = [len(shard) for shard in
+                   np.array_split(np.arange(n_resamples), n_jobs)]
+    shards = [(kind, shard_seed, ratings, weights, flags, shard_size,
+               chunk_size) for shard_seed, shard_size in zip(seeds, shard_sizes)]
+
+    if n_jobs == 1:
+        return run_shard(*shards[0])
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return np.concatenate(list(executor.map(run_shard, *zip(*shards))))
+
+
+def ingredient_effects(df, n_resamples=5000, weighted=False, confidence=0.95,
+                       min_rating_count=3, n_jobs=None, seed=0,
+                       min_group_size=3):
+    """
+    Returns a dataframe with one row per contains_ column of the given
+    processed data: the number of rated products with and without the
+    ingredient, their (rating_count weighted, if weighted is True) mean
+    ratings, the difference, its stratified bootstrap confidence interval and
+    its two-sided permutation p-value. The interval is NaN if fewer than
+    min_group_size rated products have (or don't have) the ingredient
+    """
+    ratings, weights, flags, flag_names = get_effect_inputs(
+        df, min_rating_count, weighted)
+
+    observed = mean_differences(ratings * weights, weights, flags)
+    bootstrap = resample_differences(
+        'bootstrap', ratings, weights, flags, n_resamples, seed, n_jobs)
+    permutation = resample_differences(
+        'permutation', ratings, weights, flags, n_resamples, seed + 1, n_jobs)
+
+    alpha = (1 - confidence) / 2
+    ci_low, ci_high = np.quantile(bootstrap, [alpha, 1 - alpha], axis=0)
+    with np.errstate(invalid='ignore'):
+        extreme = np.abs(permutation) >= np.abs(observed) - 1e-12
+    p_value = (extreme.sum(axis=0) + 1) / (n_resamples + 1)
+
+    # a flag no rated product (or every rated product) has has no effect to
+    # test, so leave its interval and p-value undefined
+    undefined = np.isnan(observed)
+    p_value[undefined] = np.nan
+    n_with = flags.sum(axis=0)
+    too_few = undefined | (np.minimum(n_with, len(ratings) - n_with)
+                           < min_group_size)
+    ci_low[too_few], ci_high[too_few] = np.nan, np.nan
+
+    weighted_ratings = ratings * weights
+    with_sum, with_weight = weighted_ratings @ flags, weights @ flags
+    without_weight = weights.sum() - with_weight
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_with = np.where(with_weight > 0, with_sum / with_weight, np.nan)
+        mean_without = np.where(
+            without_weight > 0,
+            (weighted_ratings.sum() - with_sum) / without_weight, np.nan)
+
+    effects = pd.DataFrame({
+        'ingredient': [name[len('contains_'):] for name in flag_names],
+        'n_with': n_with.astype(int),
+        'n_without': (len(ratings) - n_with).astype(int),
+        'mean_with': mean_with, 'mean_without': mean_without,
+        'difference': observed, 'ci_low': ci_low, 'ci_high': ci_high,
+        'p_value': p_value})
+    return effects.sort_values('difference', ascending=False,
+                               ignore_index=True)
+
+
+def main():
+    df = pd.read_csv('processed_data.csv')
+    pd.set_option('display.width', 120)
+    print(ingredient_effects(df, n_resamples=5000))
+    print(ingredient_effects(df, n_resamples=5000, weighted=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""
+Implements a dictionary that normalizes the raw ingredient names in the
+junction table to canonical integer ingredient IDs, so ingredient features can
+be computed with exact ID matches instead of substring searches
+"""
+import itertools
+import json
+import re
+
+import numpy as np
+import pandas as pd
+import data_prep as prep
+
+
+PARENTHESES = re.compile(r'\(([^)]*)\)')
+NOT_NAME_CHARS = re.compile(r'[^a-z0-9/ ]+')
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_ingredient(name):
+    """
+    Returns the normalized key of an ingredient name: lower case, without
+    parenthetical synonyms, hyphens or other punctuation, and with single
+    spaces. If the name is only a parenthetical, its contents are kept
+    ex. 'Vitis Vinifera(Grape) Seed Oil' -> 'vitis vinifera seed oil'
+        'PEG-20 Glyceryl Trii-sostearate' -> 'peg20 glyceryl triisostearate'
+    """
+    name = name.lower()
+    without_synonyms = PARENTHESES.sub(' ', name)
+    if without_synonyms.strip() == '':
+        without_synonyms = PARENTHESES.sub(r'\1', name)
+    key = NOT_NAME_CHARS.sub('', without_synonyms)
+    return WHITESPACE.sub(' ', key).strip()
+
+
+def compact(key):
+    """
+    Returns the given normalized key without spaces, so spellings that only
+    differ by spacing (ex. 'ceramide3', 'ceramide 3') get the same ID
+    """
+    return key.replace(' ', '')
+
+
+# misspellings seen in the scraped lists that don't only differ by spaces,
+# hyphens or case, as normalized keys of the misspelling and correct name
+INGREDIENT_ALIASES = {
+    'glycerine': 'glycerin',
+    'allantonin': 'allantoin',
+    'butylene glyco': 'butylene glycol',
+    'buthylene glycol': 'butylene glycol',
+    'propylen glycol': 'propylene glycol',
+    'capriylyl glycol': 'caprylyl glycol',
+    '12hexanedio': '12hexanediol',
+    'ethylhexyglycerin': 'ethylhexylglycerin',
+    'ethylhexylglycerine': 'ethylhexylglycerin',
+    'hydroxyethelcellulose': 'hydroxyethylcellulose',
+    'methylpropandediol': 'methylpropanediol',
+    'sodium polyacrylaste': 'sodium polyacrylate',
+    'polygutamic acid': 'polyglutamic acid',
+    'centella asiatic extract': 'centella asiatica extract',
+    'rosemarinus officinalis leaf oil': 'rosmarinus officinalis leaf oil',
+    'aniba rosodora wood oil': 'aniba rosaeodora wood oil',
+    'peg20 glyceryl triisosterarate': 'peg20 glyceryl triisostearate',
+    'sodium acrylate/sodium acryloyldimethyl taureate copolymer':
+        'sodium acrylate/sodium acryloyldimethyl taurate copolymer',
+    'hydroxyethyl acrylate/soduium acryloyldimethyl taurate copolymer':
+        'hydroxyethyl acrylate/sodium acryloyldimethyl taurate copolymer',
+}
+
+
+def match_text(name):
+    """
+    Returns the text of an ingredient name that ingredient patterns are
+    matched against: normalized like normalize_ingredient, but keeping the
+    contents of parenthetical synonyms
+    ex. 'Sinensis (Green Tea) Leaf' -> 'sinensis green tea leaf'
+    """
+    text = NOT_NAME_CHARS.sub('', PARENTHESES.sub(r' \1 ', name.lower()))
+    return WHITESPACE.sub(' ', text).strip()
+
+
+class IngredientDictionary:
+    """
+    Maps raw ingredient names to canonical integer IDs. Raw names already seen
+    are looked up in O(1); new names are normalized, so spellings that only
+    differ by case, spaces, hyphens or parenthetical synonyms share an ID, and
+    known misspellings are mapped with the aliases table
+    """
+
+    def __init__(self, aliases=None):
+        if aliases is None:
+            aliases = INGREDIENT_ALIASES
+        self.aliases = {compact(typo): correct
+                        for typo, correct in aliases.items()}
+        self.names = []             # canonical display name of each ID
+        self.key_ids = dict()       # normalized key without spaces -> ID
+        self.raw_ids = dict()       # raw name -> ID, the memoized lookup
+        self.match_texts = dict()   # match_text of each spelling -> ID
+
+    def __len__(self):
+        return len(self.names)
+
+    def spelling(self, name):
+        """
+        Returns the key without spaces and the match_text of the given raw 
+        ingredient name, with known misspellings replaced by the correct name
+        """
+        key = compact(normalize_ingredient(name))
+        text = match_text(name)
+        if key in self.aliases:
+            # match the correct spelling, not the typo (ex. taureate -> urea)
+            text = self.aliases[key]
+            key = compact(text)
+        return key, text
+
+    def get_id(self, name, add=True):
+        """
+        Returns the ID of the given raw ingredient name. Unknown ingredients
+        get a new ID, or -1 if add is False. With add False the dictionary is 
+        never changed, so lookups of untrusted names can't grow it
+        """
+        if name in self.raw_ids:
+            return self.raw_ids[name]
+
+        key, text = self.spelling(name)
+        if key not in self.key_ids:
+            if not add or key == '':
+                return -1
+            self.key_ids[key] = len(self.names)
+            self.names.append(name.strip())
+        if not add:
+            return self.key_ids[key]
+
+        self.raw_ids[name] = self.key_ids[key]
+        self.match_texts.setdefault(text, self.key_ids[key])
+        return self.raw_ids[name]
+
+    def encode(self, ingredients, add=True):
+        """
+        Returns an array of the IDs of the given series of raw ingredient
+        names. Each distinct name is only looked up once, and missing names
+        get -1
+        """
+        codes, uniques = pd.factorize(ingredients)
+        unique_ids = np.array([self.get_id(name, add) for name in uniques]
+                              + [-1], dtype=np.int64)
+        return unique_ids[codes]
+
+    def save(self, file_path):
+        """
+        Saves the dictionary to the given JSON file
+        """
+        with open(file_path, 'w') as dict_file:
+            json.dump({'names': self.names, 'key_ids': self.key_ids,
+                       'raw_ids': self.raw_ids,
+                       'match_texts': self.match_texts}, dict_file)
+
+    @classmethod
+    def load(cls, file_path, aliases=None):
+        """
+        Returns the dictionary saved to the given JSON file
+        """
+        with open(file_path) as dict_file:
+            saved = json.load(dict_file)
+        ingredient_dict = cls(aliases)
+        ingredient_dict.names = saved['names']
+        ingredient_dict.key_ids = saved['key_ids']
+        ingredient_dict.raw_ids = saved['raw_ids']
+        ingredient_dict.match_texts = saved['match_texts']
+        return ingredient_dict
+
+
+def load_or_create_dictionary(file_path, junction_table=None):
+    """
+    Returns the ingredient dictionary saved at the given file path, or a new
+    one if there is none. If a junction table is given, its ingredients are
+    added and the dictionary is saved back to the file path
+    """
+    try:
+        ingredient_dict = IngredientDictionary.load(file_path)
+    except FileNotFoundError:
+        ingredient_dict = IngredientDictionary()
+
+    if junction_table is not None:
+        ingredient_dict.encode(junction_table['ingredient'])
+        ingredient_dict.save(file_path)
+    return ingredient_dict
+
+
+def add_ingredient_ids(junction_table, ingredient_dict):
+    """
+    Adds an ingredient_id column to the junction table and returns it
+    """
+    junction_table['ingredient_id'] = ingredient_dict.encode(
+        junction_table['ingredient'])
+    return junction_table
+
+
+class IngredientFeatureBuilder:
+    """
+    Cleans products and adds the ingredient features used for classification 
+    (ingredient_counts, the contains_ columns, star_ingred_counts and the top 
+    ingredient features) from exact ingredient ID matches. classification, 
+    streaming and scoring_service all build their features with it, so they 
+    match. The cleaning rules and which IDs each feature looks for are 
+    compiled once and kept between calls
+    """
+
+    def __init__(self, ingredient_dict, top_percentiles=(0.1, 0.25, 0.5),
+                 bad_phrases_path='not_ingredients.txt',
+                 rule_phrases_path='non_ingredient_phrases.txt'):
+        self.ingredient_dict = ingredient_dict
+        self.top_percentiles = top_percentiles
+        self.bad_phrases = prep.compile_bad_phrases(bad_phrases_path)
+        self.cleaning_rules = prep.compile_cleaning_rules(
+            self.bad_phrases, prep.INGREDIENTS_FIXES)
+        self.rule_phrases = prep.compile_rule_phrases(rule_phrases_path)
+
+        feature_patterns = prep.make_contains_columns_dict()
+        self.contains_columns = list(feature_patterns.keys())
+        feature_patterns['star'] = prep.make_star_ingredients_list()
+        self.feature_regexes = [
+            re.compile('|'.join(match_text(pattern) for pattern in patterns))
+            for patterns in feature_patterns.values()]
+        self.feature_columns = list(feature_patterns.keys())
+
+        # which features each ingredient ID counts for, with an extra last
+        # row of all False that ID -1 (unknown ingredient) indexes
+        self.id_features = np.zeros((1, len(self.feature_columns)), dtype=bool)
+        self.texts_matched = 0
+
+    def update_id_features(self):
+        """
+        Matches the feature patterns against the spellings added to the 
+        ingredient dictionary since the last call only
+        """
+        match_texts = self.ingredient_dict.match_texts
+        new_rows = len(self.ingredient_dict) + 1 - len(self.id_features)
+        if new_rows <= 0 and len(match_texts) == self.texts_matched:
+            return
+        if new_rows > 0:
+            self.id_features = np.vstack([
+                self.id_features[:-1],
+                np.zeros((new_rows, len(self.feature_columns)), dtype=bool),
+                self.id_features[-1:]])
+        for text, ingredient_id in itertools.islice(
+                match_texts.items(), self.texts_matched, None):
+            self.id_features[ingredient_id] |= self.match_patterns(text)
+        self.texts_matched = len(match_texts)
+
+    def match_patterns(self, text):
+        """
+        Returns whether the given match_text matches each feature's patterns
+        """
+        return np.array([regex.search(text) is not None
+                         for regex in self.feature_regexes])
+
+    def match_features(self, name):
+        """
+        Returns which features a raw ingredient name counts for without 
+        adding it to the dictionary: those of its ID, if it has one, and those 
+        its own spelling matches. Assumes update_id_features is up to date
+        """
+        ingredient_id = self.ingredient_dict.get_id(name, add=False)
+        row = self.id_features[ingredient_id].copy()
+        _, text = self.ingredient_dict.spelling(name)
+        if text not in self.ingredient_dict.match_texts:
+            row = row | self.match_patterns(text)
+        return row
+
+    def count_features(self, codes, n_products, row_features):
+        """
+        Returns a dict of the ingredient feature columns as arrays over 
+        products, given the product number of each ingredient row (in list 
+        order) and the features each row counts for
+        """
+        counts = np.bincount(codes, minlength=n_products)
+        feature_counts = np.column_stack([
+            np.bincount(codes, weights=row_features[:, j], minlength=n_products)
+            for j in range(len(self.feature_columns))])
+
+        features = {'ingredient_counts': counts}
+        for j, column_name in enumerate(self.contains_columns):
+            features[column_name] = feature_counts[:, j] > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            features['star_ingred_counts'] = feature_counts[:, -1] / counts
+        features.update(prep.top_ingredient_arrays(
+            codes, n_products, row_features[:, -1], self.top_percentiles))
+        return features
+
+    def add_features(self, df, junction_table):
+        """
+        Adds the ingredient features to the dataframe given its junction table 
+        with an ingredient_id column, and returns the new df
+        """
+        self.update_id_features()
+        row_features = self.id_features[
+            junction_table['ingredient_id'].to_numpy()]
+        codes, skus = pd.factorize(junction_table['sku'])
+
+        # products without junction table rows take an extra, empty product
+        features = self.count_features(codes, len(skus) + 1, row_features)
+        product_rows = skus.get_indexer(df['sku'])
+        product_rows[product_rows < 0] = len(skus)
+        features = pd.DataFrame(
+            {column_name: values[product_rows]
+             for column_name, values in features.items()}, index=df.index)
+
+        return pd.concat(
+            [df.drop(columns=list(features.columns), errors='ignore'),
+             features], axis=1)
+
+    def clean(self, df, quarantine=True):
+        """
+        Returns the given raw products cleaned with the compiled rules, 
+        without the quarantined ones if quarantine is True
+        """
+        return prep.clean_data(df, quarantine=quarantine,
+                               rule_phrases=self.rule_phrases,
+                               cleaning_rules=self.cleaning_rules)
+
+    def build(self, df, quarantine=True):
+        """
+        Cleans the given raw products (dropping quarantined ones if 
+        quarantine is True), and returns the products with their ingredient 
+        features and their junction table with an ingredient_id column
+        """
+        df = self.clean(df, quarantine)
+        junction_table = prep.create_junction_table(df)
+        junction_table = add_ingredient_ids(
+            junction_table, self.ingredient_dict)
+        return self.add_features(df, junction_table), junction_table
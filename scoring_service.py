@@ -0,0 +1,357 @@
+"""
+Implements a long-running local HTTP service that predicts the rating bin of
+skincare products from their raw product info using a persisted classifier.
+Concurrent requests are micro-batched so the cleaning, feature and predict
+steps run once per batch instead of once per product
+"""
+import argparse
+import asyncio
+import functools
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import data_prep as prep
+import ingredient_ids as ids
+import classification as clf
+
+# largest request body and number of headers read from a client
+MAX_BODY_SIZE = 1 << 20
+MAX_HEADERS = 100
+
+
+def validate_product(product):
+    """
+    Returns the fields of a raw product dict that the scorer uses, with price
+    and rating_count cast to numbers. Raises a ValueError or TypeError for a
+    product that can't be scored, so it is rejected before it is batched
+    """
+    if not isinstance(product, dict):
+        raise ValueError('expected a JSON object')
+    ingredients = product.get('ingredients')
+    if not isinstance(ingredients, str) or not ingredients.strip():
+        raise ValueError('product is missing an ingredients string')
+
+    try:
+        price = float(product.get('price', 0.0))
+        rating_count = int(product.get('rating_count', 0))
+    except OverflowError:
+        raise ValueError('price and rating_count must be finite numbers')
+    if not math.isfinite(price):
+        raise ValueError('price must be a finite number')
+
+    fields = {'product_name': product.get('product_name',
+                                          product.get('name', '')),
+              'brand': product.get('brand', ''),
+              'category': product.get('category')}
+    for name, value in fields.items():
+        if value is not None and not isinstance(value, str):
+            raise TypeError(name + ' must be a string')
+
+    return {'product_name': fields['product_name'], 'brand': fields['brand'],
+            'price': price, 'rating_count': rating_count,
+            'ingredients': ingredients, 'category': fields['category']}
+
+
+class RatingScorer:
+    """
+    Keeps the fitted classifier, the feature builder's compiled cleaning 
+    rules and ID feature table, and a bounded cache of the features of each 
+    ingredient name seen in requests in memory, and predicts the rating bins 
+    of a batch of raw products at once. Request ingredients are looked up 
+    without being added to the ingredient dictionary
+    """
+
+    def __init__(self, model_path, dictionary_path='ingredient_ids.json',
+                 cache_size=100000):
+        self.model = clf.load_model(model_path)
+        self.builder = ids.IngredientFeatureBuilder(
+            ids.load_or_create_dictionary(dictionary_path))
+        self.feature_names = list(self.model.feature_names_in_)
+        self.column_of = {column_name: j for j, column_name
+                          in enumerate(self.feature_names)}
+        # match every known ingredient against the feature patterns at start
+        # up, then only request spellings missing from the dictionary
+        self.builder.update_id_features()
+        self.ingredient_features = functools.lru_cache(maxsize=cache_size)(
+            self.builder.match_features)
+
+    def make_features(self, products):
+        """
+        Returns the float32 feature matrix, aligned to the columns the
+        classifier was trained on, for the given list of raw product dicts.
+        The features are those of IngredientFeatureBuilder.build (without the
+        quarantine) and get_dummies, computed from lists and cached
+        ingredient lookups instead of dataframes. Raises an error if any
+        product fails validate_product
+        """
+        products = [validate_product(product) for product in products]
+        rules = self.builder.cleaning_rules
+        ingredient_lists = [
+            [name for name in prep.split_ingredients_text(
+                prep.clean_ingredients_text(product['ingredients'], rules))
+             if name]
+            for product in products]
+
+        names = [name for names in ingredient_lists for name in names]
+        row_features = np.array(
+            [self.ingredient_features(name) for name in names], dtype=bool)
+        row_features = row_features.reshape(
+            len(names), len(self.builder.feature_columns))
+        codes = np.repeat(np.arange(len(products)),
+                          [len(names) for names in ingredient_lists])
+        features = self.builder.count_features(
+            codes, len(products), row_features)
+        features['price'] = [product['price'] for product in products]
+        features['rating_count'] = [product['rating_count']
+                                    for product in products]
+
+        matrix = np.zeros((len(products), len(self.feature_names)),
+                          dtype=np.float32)
+        for column_name, values in features.items():
+            if column_name in self.column_of:
+                matrix[:, self.column_of[column_name]] = values
+
+        # one-hot encode like get_dummies, brands or categories unseen in
+        # training stay all zeros
+        for i, product in enumerate(products):
+            for column_name in ('brand', 'category'):
+                if product[column_name] is None:
+                    continue
+                j = self.column_of.get(column_name + '_' + product[column_name])
+                if j is not None:
+                    matrix[i, j] = 1
+        return matrix
+
+    def score(self, products):
+        """
+        Returns the predicted rating bins for the given list of raw product
+        dicts, in order
+        """
+        features = self.make_features(products)
+        return [str(label) for label in self.predict(features)]
+
+    def predict(self, features):
+        """
+        Returns the model's predictions for the given feature matrix. Forests 
+        are averaged tree by tree in this thread, which gives the same labels 
+        as model.predict without dispatching every tree through joblib
+        """
+        trees = getattr(self.model, 'estimators_', None)
+        if not isinstance(trees, list) or not hasattr(trees[0], 'tree_'):
+            return self.model.predict(
+                pd.DataFrame(features, columns=self.feature_names))
+
+        X = np.ascontiguousarray(features, dtype=np.float32)
+        proba = trees[0].predict_proba(X, check_input=False)
+        for tree in trees[1:]:
+            proba = proba + tree.predict_proba(X, check_input=False)
+        return self.model.classes_[np.argmax(proba, axis=1)]
+
+
+class MicroBatcher:
+    """
+    Collects concurrently submitted products into batches of at most
+    max_batch_size, waiting at most max_wait seconds after the first product
+    of a batch arrives, and scores each batch with a single scorer call
+    """
+
+    def __init__(self, scorer, max_batch_size=64, max_wait=0.005):
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        # a single worker keeps pandas/sklearn work off the event loop
+        # without running two batches over the same model at once
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, product):
+        """
+        Queues the given product and returns its predicted rating bin once the
+        batch containing it has been scored. Products that fail
+        validate_product raise right away and are never queued
+        """
+        product = validate_product(product)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((product, future))
+        return await future
+
+    async def next_batch(self):
+        """
+        Waits for the next batch of queued products and returns it
+        """
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(
+                    await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        """
+        Scores batches of queued products until cancelled
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.next_batch()
+            products = [product for product, _ in batch]
+            try:
+                labels = await loop.run_in_executor(
+                    self.executor, self.scorer.score, products)
+            except Exception:
+                # queued products are already validated, so this is an
+                # unexpected error; score products one at a time so it only
+                # fails the requests whose products cause it
+                for product, future in batch:
+                    try:
+                        label = await loop.run_in_executor(
+                            self.executor, self.scorer.score, [product])
+                        future.set_result(label[0])
+                    except Exception as error:
+                        future.set_exception(error)
+                continue
+            for (_, future), label in zip(batch, labels):
+                future.set_result(label)
+
+
+async def read_request(reader):
+    """
+    Returns the method, path, headers and body of the next HTTP request on the
+    given stream, or None if the client closed the connection. Raises a
+    ValueError for a malformed request line or header, or a Content-Length
+    that isn't a whole number up to MAX_BODY_SIZE
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    parts = request_line.decode('latin-1').rstrip('\r\n').split(' ')
+    if len(parts) != 3:
+        raise ValueError('malformed request line')
+    method, path, _ = parts
+
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        if len(headers) == MAX_HEADERS:
+            raise ValueError('too many headers')
+        name, colon, value = line.decode('latin-1').partition(':')
+        if not colon:
+            raise ValueError('malformed header')
+        headers[name.strip().lower()] = value.strip()
+
+    body = b''
+    if 'content-length' in headers:
+        length = headers['content-length']
+        if not (length.isascii() and length.isdigit()):
+            raise ValueError('Content-Length must be a whole number')
+        if int(length) > MAX_BODY_SIZE:
+            raise ValueError('request body is larger than '
+                             + str(MAX_BODY_SIZE) + ' bytes')
+        body = await reader.readexactly(int(length))
+    return method, path, headers, body
+
+
+def make_response(status, content):
+    """
+    Returns the bytes of an HTTP response with the given status and JSON
+    content
+    """
+    body = json.dumps(content).encode()
+    head = ('HTTP/1.1 ' + status + '\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: ' + str(len(body)) + '\r\n\r\n')
+    return head.encode() + body
+
+
+async def handle_connection(batcher, reader, writer):
+    """
+    Serves HTTP requests on one keep-alive connection. POST /predict takes a
+    raw product JSON object and returns its predicted rating_bin. A malformed
+    request gets a 400 response and closes the connection
+    """
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except ValueError as error:
+                writer.write(make_response(
+                    '400 Bad Request', {'error': str(error)}))
+                await writer.drain()
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+
+            if method == 'GET' and path == '/health':
+                response = make_response('200 OK', {'status': 'ok'})
+            elif method == 'POST' and path == '/predict':
+                try:
+                    product = json.loads(body)
+                    rating_bin = await batcher.submit(product)
+                    response = make_response(
+                        '200 OK', {'rating_bin': rating_bin})
+                except (ValueError, TypeError, RecursionError) as error:
+                    # RecursionError comes from too deeply nested JSON
+                    response = make_response(
+                        '400 Bad Request', {'error': str(error)})
+            else:
+                response = make_response('404 Not Found', {'error': path})
+
+            writer.write(response)
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(model_path, host='127.0.0.1', port=8000, max_batch_size=64,
+                max_wait=0.005):
+    """
+    Loads the model once and serves rating predictions until cancelled
+    """
+    batcher = MicroBatcher(RatingScorer(model_path), max_batch_size, max_wait)
+    batch_task = asyncio.ensure_future(batcher.run())
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(batcher, reader, writer),
+        host, port)
+    print('Serving rating predictions on http://' + host + ':' + str(port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batch_task.cancel()
+        batcher.executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', default='rating_model.pkl')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.model, args.host, args.port,
+                      args.max_batch_size, args.max_wait_ms / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Implements a streaming mode of the pipeline from the Soko Glam scraper to the
+processed features. Product records flow through generators for the cleaning,
+junction table and feature stages, each stage runs in its own thread behind a
+bounded queue, and processed rows are written as soon as they are ready, so
+crawling, processing and writing overlap
+"""
+import queue
+import threading
+
+import pandas as pd
+import data_prep as prep
+import ingredient_ids as ids
+import web_scrape as scrape
+
+
+DONE = object()
+
+
+def threaded(items, maxsize=8):
+    """
+    Runs the given iterable in a background thread and yields its items
+    through a queue of at most maxsize items. A full queue blocks the thread,
+    so a slow consumer holds back the producer. Errors in the thread are
+    re-raised in the consumer
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                while not stop.is_set():
+                    try:
+                        buffer.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            buffer.put(DONE)
+        except BaseException as error:
+            buffer.put(error)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def batch_records(records, chunk_size=32):
+    """
+    Yields lists of at most chunk_size product records from the given
+    iterable of product records
+    """
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def clean_chunks(chunks, builder):
+    """
+    Yields the cleaned products of each list of product records, skipping 
+    chunks with no products left after the quarantine
+    """
+    for chunk in chunks:
+        df = builder.clean(pd.DataFrame(chunk))
+        if not df.empty:
+            yield df
+
+
+def junction_chunks(cleaned_chunks):
+    """
+    Yields each cleaned products dataframe with its junction table
+    """
+    for df in cleaned_chunks:
+        yield df, prep.create_junction_table(df)
+
+
+def feature_chunks(junction_pairs, builder):
+    """
+    Yields each pair of cleaned products and junction table with ingredient 
+    IDs and features added. Each sku is only kept in the junction table once 
+    across chunks
+    """
+    added_skus = set()
+    for df, junction_table in junction_pairs:
+        junction_table = ids.add_ingredient_ids(
+            junction_table, builder.ingredient_dict)
+        df = builder.add_features(df, junction_table)
+
+        junction_table = junction_table[
+            ~junction_table['sku'].isin(added_skus)]
+        added_skus.update(junction_table['sku'])
+        yield df, junction_table
+
+
+def process_chunks(chunks, top_percentiles=(0.1, 0.25, 0.5),
+                   dictionary_path='ingredient_ids.json', queue_size=8):
+    """
+    Yields a (processed products, junction table) pair of dataframes for each
+    list of product records, with the same IngredientFeatureBuilder steps as
+    classification.main(). The cleaning and junction table stages each run in
+    their own thread behind a bounded queue, and the feature stage, the only 
+    one using the ingredient dictionary, runs in the caller's thread. The 
+    dictionary is saved once every chunk is processed
+    """
+    ingredient_dict = ids.load_or_create_dictionary(dictionary_path)
+    builder = ids.IngredientFeatureBuilder(ingredient_dict, top_percentiles)
+
+    cleaned_chunks = threaded(clean_chunks(chunks, builder), queue_size)
+    junction_pairs = threaded(junction_chunks(cleaned_chunks), queue_size)
+    yield from feature_chunks(junction_pairs, builder)
+
+    ingredient_dict.save(dictionary_path)
+
+
+def write_chunks(processed_chunks, data_path='processed_data.csv',
+                 junction_path='junction_table.csv'):
+    """
+    Appends each pair of processed products and junction table chunks to the
+    given csv files as it arrives and returns the number of products written
+    """
+    product_count = 0
+    with open(data_path, 'w', newline='') as data_file, \
+            open(junction_path, 'w', newline='') as junction_file:
+        for df, junction_table in processed_chunks:
+            df.to_csv(data_file, index=None, sep=',',
+                      header=product_count == 0)
+            junction_table.to_csv(junction_file, index=None,
+                                  header=product_count == 0)
+            data_file.flush()
+            junction_file.flush()
+            product_count = product_count + len(df.index)
+    return product_count
+
+
+def run_streaming_pipeline(records, data_path='processed_data.csv',
+                           junction_path='junction_table.csv', chunk_size=32,
+                           queue_size=8):
+    """
+    Streams the given iterable of product records through cleaning, junction
+    table and feature stages into the given csv files, with the crawl and 
+    each stage running in their own thread behind bounded queues while this 
+    thread writes. Returns the number of products written
+    """
+    chunks = batch_records(threaded(records, queue_size * chunk_size),
+                           chunk_size)
+    processed_chunks = threaded(
+        process_chunks(chunks, queue_size=queue_size), queue_size)
+    return write_chunks(processed_chunks, data_path, junction_path)
+
+
+def main():
+    url_dictionary = scrape.get_catgories_dict()
+    product_count = run_streaming_pipeline(scrape.iter_products(url_dictionary))
+    print('Wrote', product_count, 'processed products')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Tests functions for training the incremental rating classifier out of core
+"""
+import classification as clf
+import os
+import pandas as pd
+import tempfile
+
+
+def make_processed_data(brands):
+    """
+    Returns a small processed dataframe with one product per given brand,
+    where COSRX products are rated high and the others low
+    """
+    n_products = len(brands)
+    return pd.DataFrame({
+        'product_name': ['Product ' + str(i) for i in range(n_products)],
+        'sku': ['sku-' + str(i) for i in range(n_products)],
+        'brand': brands,
+        'subcategory': ['Toners'] * n_products,
+        'price': [20.0 + i for i in range(n_products)],
+        'rating': [4.9 if brand == 'COSRX' else 3.5 for brand in brands],
+        'rating_count': [10] * n_products,
+        'ingredients': ['Water, Glycerin'] * n_products,
+        'contains_niacinamide': [brand == 'COSRX' for brand in brands]})
+
+
+def test_scan_feature_names():
+    """
+    Test that brands only seen in a later chunk still get a feature column
+    """
+    print('Testing scan_feature_names():')
+    df = make_processed_data(['COSRX'] * 4 + ['Klairs'] * 4 + ['Heimish'])
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, 'processed_data.csv')
+        df.to_csv(file_path, index=None)
+        feature_names = clf.scan_feature_names(file_path, chunk_size=4)
+    print([name for name in feature_names if name.startswith('brand_')])
+    # ['brand_COSRX', 'brand_Klairs', 'brand_Heimish']
+
+
+def test_train_incremental():
+    """
+    Test that updating a model only ingests the products it hasn't seen
+    """
+    print('Testing train_incremental():')
+    df = make_processed_data(['COSRX', 'Klairs'] * 20)
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, 'processed_data.csv')
+        df.iloc[:20].to_csv(file_path, index=None)
+        model, _ = clf.train_incremental(file_path, chunk_size=8)
+        print(len(model.trained_skus))  # 20
+
+        df.to_csv(file_path, index=None)
+        model, _ = clf.train_incremental(file_path, model, chunk_size=8)
+        print(len(model.trained_skus))  # 40
+
+        coefficients = model.model.coef_.copy()
+        model, _ = clf.train_incremental(file_path, model, chunk_size=8)
+        print((model.model.coef_ == coefficients).all())  # True
+
+
+def test_is_holdout():
+    """
+    Test that the holdout split of a sku doesn't depend on its chunk
+    """
+    print('Testing is_holdout():')
+    skus = pd.Series(['sku-' + str(i) for i in range(1000)])
+    holdout = clf.is_holdout(skus)
+    print(0.15 < holdout.mean() < 0.25)  # True
+    print((clf.is_holdout(skus.iloc[500:]) == holdout[500:]).all())  # True
+
+
+def main():
+    test_scan_feature_names()
+    test_train_incremental()
+    test_is_holdout()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Tests the ingredient co-occurrence engine
+"""
+import cooccurrence as co
+import pandas as pd
+
+
+def make_junction_table():
+    """
+    Returns a small junction table where niacinamide appears with zinc PCA in
+    three products and with panthenol in two
+    """
+    products = {
+        'sku-0': ['Water', 'Niacinamide', 'Zinc PCA', 'Panthenol'],
+        'sku-1': ['Water', 'Niacinamide', 'Zinc PCA'],
+        'sku-2': ['Water', 'Niacinamide', 'Zinc PCA', 'Panthenol'],
+        'sku-3': ['Water', 'Glycerin', 'Panthenol'],
+        'sku-4': ['Water', 'Glycerin'],
+    }
+    return pd.DataFrame([(sku, ingredient) for sku, ingredients
+                         in products.items() for ingredient in ingredients],
+                        columns=['sku', 'ingredient'])
+
+
+def test_top_k():
+    """
+    Test the top_k function
+    """
+    print('Testing top_k():')
+    ratings = pd.DataFrame({'sku': ['sku-' + str(i) for i in range(5)],
+                            'rating': [5.0, 4.0, 4.5, 3.0, 2.0],
+                            'rating_count': [10, 10, 1, 10, 10]})
+    engine = co.CooccurrenceEngine(make_junction_table(), ratings,
+                                   min_support=2)
+    top = engine.top_k('niacinamide', k=3)
+    print(top)
+    print(list(top['ingredient']))  # ['Water', 'Zinc PCA', 'Panthenol']
+    print(list(top['count']))  # [3, 3, 2]
+    # sku-2 has too few ratings, so both pairs average sku-0 and sku-1 only
+    print(list(top['rated_count']))  # [2, 2, 1]
+    print(list(top['mean_rating']))  # [4.5, 4.5, 5.0]
+
+    # lift of zinc PCA: 3 * 5 products / (3 * 3)
+    print(round(engine.top_k('niacinamide', by='lift')['lift'][0], 4))
+    # 1.6667
+
+
+def test_min_support():
+    """
+    Test that ingredients below min_support are rejected by name
+    """
+    print('Testing min_support:')
+    engine = co.CooccurrenceEngine(make_junction_table(), min_support=3)
+    try:
+        engine.top_k('glycerin')
+    except KeyError:
+        print('KeyError')  # KeyError
+    print(len(engine.pair_table()))  # 4
+
+
+def test_existing_ingredient_ids():
+    """
+    Test that a junction table with an ingredient_id column from another 
+    dictionary is re-encoded when no dictionary is given
+    """
+    print('Testing existing ingredient IDs:')
+    junction_table = make_junction_table()
+    junction_table['ingredient_id'] = 1000 + junction_table.index
+    engine = co.CooccurrenceEngine(junction_table, min_support=2)
+    print(list(engine.top_k('zinc pca')['ingredient']))
+    # ['Water', 'Niacinamide', 'Panthenol']
+
+
+def main():
+    test_top_k()
+    test_min_support()
+    test_existing_ingredient_ids()
+
+
+if __name__ == '__main__':
+    main()
@@ -24,10 +24,83 @@ def test_clean_ingredients():
     print(df2.loc[df2['sku'] == 'COC-OTMC-17'].values[0])
     print(df2.loc[df2['sku'] == 'MF-BBAT-25'].values[0])
     print(df2.loc[df2['sku'] == 'JTC-WWB-33'].values[0])
+
+
+def test_analyze_duplicated_skus():
+    """
+    Test the analyze_duplicated_skus function
+    """
+    print('Testing analyze_duplicated_skus():')
+    data = pd.read_csv('skincare_data.csv')
+    duplicated, unique = prep.analyze_duplicated_skus(data)
+
+    print(duplicated.head())
+    print(len(unique) == data['sku'].nunique())  # True
+    print((duplicated['row_count'] > 1).all())  # True
+    unique_skus = prep.find_unique_skus(data)
+    print(len(unique_skus) == len(set(unique_skus)))  # True
+    print(unique_skus == list(unique['sku']))  # True
+
+
+def test_validate_ingredient_lists():
+    """
+    Test the validate_ingredient_lists function
+    """
+    print('Testing validate_ingredient_lists():')
+    data = pd.DataFrame({'ingredients': [
+        'Water, Glycerin, 1,2-Hexanediol',
+        'Sodium Hyaluronate',
+        'Please refer to each product page for its specific list of ingredients',
+        'WaterPropylene GlycolDipropylene GlycolMethyl Gluceth-20Glycyrrhiza '
+        'Glabra (Licorice) Root ExtractSodium Ascorbyl Phosphate',
+        None]})
+    report = prep.validate_ingredient_lists(data)
+
+    print(list(report['token_count']))  # [3, 1, 1, 1, 0]
+    print(list(report['quarantine']))  # [False, False, True, True, True]
+    print(list(report['reasons']))
+    # ['', '', 'missing_commas;non_ingredient_phrase',
+    #  'missing_commas;long_tokens', 'empty']
+
+
+def test_quarantine_covers_incomplete_skus():
+    """
+    Test that clean_data quarantines every product in the hand-made list of 
+    skus with incomplete ingredients lists it replaces
+    """
+    print('Testing clean_data() quarantine:')
+    data = pd.read_csv('skincare_data.csv')
+    cleaned = prep.clean_data(data)
+    with open('incomplete_ingredients_skus.txt') as skus:
+        incomplete_skus = {sku.strip() for sku in skus.readlines()}
+
+    print(incomplete_skus & set(cleaned['sku']))  # set()
+
+
+def test_get_top_ingredient_features():
+    """
+    Test the get_top_ingredient_features function
+    """
+    print('Testing get_top_ingredient_features():')
+    junction_table = pd.DataFrame({
+        'sku': ['A'] * 4 + ['B'] * 2,
+        'ingredient': ['Niacinamide', 'Water', 'Glycerin', 'Salicylic Acid',
+                       'Water', 'Glycerin']})
+    features = prep.get_top_ingredient_features(
+        junction_table, top_percentiles=(0.25, 0.5, 1.0))
+
+    print(list(features['top_25_star_count']))  # [1, 0]
+    print(list(features['top_100_star_count']))  # [2, 0]
+    print(list(features['first_star_position']))  # [1, 0]
+    print(list(features['first_star_relative_position']))  # [0.0, 1.0]
     
 
 def main():
     test_clean_ingredients()
+    test_analyze_duplicated_skus()
+    test_validate_ingredient_lists()
+    test_quarantine_covers_incomplete_skus()
+    test_get_top_ingredient_features()
 
 
 
@@ -0,0 +1,79 @@
+"""
+Tests functions for estimating the effect of ingredients on product ratings
+"""
+import ingredient_effects as effects
+import pandas as pd
+
+
+def make_products():
+    """
+    Returns a small processed dataframe where niacinamide products are rated 
+    higher, no product has azelaic acid and every product has water
+    """
+    return pd.DataFrame({
+        'rating': [4.9, 4.8, 4.7, 4.9, 3.9, 4.0, 3.8, 4.1],
+        'rating_count': [10, 20, 5, 8, 30, 4, 6, 1],
+        'contains_niacinamide': [True] * 4 + [False] * 4,
+        'contains_azelaic_acid': [False] * 8,
+        'contains_water': [True] * 8})
+
+
+def test_ingredient_effects():
+    """
+    Test the ingredient_effects function
+    """
+    print('Testing ingredient_effects():')
+    table = effects.ingredient_effects(
+        make_products(), n_resamples=500, n_jobs=1).set_index('ingredient')
+
+    print(table)
+    print(list(table['n_with']))  # [4, 0, 7]
+    print(table.loc['niacinamide', 'difference'] > 0)  # True
+    print(table.loc['niacinamide', 'ci_low'] > 0)  # True
+    print(table.loc['niacinamide', 'p_value'] < 0.1)  # True
+    # flags no product or every product has are not reported as significant
+    print(table.loc[['azelaic_acid', 'water'], 
+                    ['difference', 'ci_low', 'ci_high', 'p_value']]
+          .isna().all().all())  # True
+
+
+def test_resample_differences():
+    """
+    Test that sharding the resamples across processes gives the requested 
+    number of resamples
+    """
+    print('Testing resample_differences():')
+    ratings, weights, flags, _ = effects.get_effect_inputs(make_products())
+    bootstrap = effects.resample_differences(
+        'bootstrap', ratings, weights, flags, 101, n_jobs=2)
+    print(bootstrap.shape)  # (101, 3)
+
+
+def test_small_groups():
+    """
+    Test that every stratified bootstrap resample has both groups of a rare 
+    flag, and that its interval isn't reported below min_group_size
+    """
+    print('Testing rare flags:')
+    products = make_products()
+    products['contains_retinol'] = [True] * 2 + [False] * 6
+    ratings, weights, flags, _ = effects.get_effect_inputs(products)
+    bootstrap = effects.resample_differences(
+        'bootstrap', ratings, weights, flags, 200, n_jobs=1)
+    print(bootstrap[:, [0, 3]].shape, (~pd.isna(bootstrap[:, [0, 3]])).all())
+    # (200, 2) True
+
+    table = effects.ingredient_effects(
+        products, n_resamples=200, n_jobs=1).set_index('ingredient')
+    print(table.loc['retinol', ['ci_low', 'ci_high']].isna().all())  # True
+    print(pd.notna(table.loc['retinol', 'p_value']))  # True
+
+
+def main():
+    test_ingredient_effects()
+    test_resample_differences()
+    test_small_groups()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Tests functions for mapping raw ingredient names to canonical ingredient IDs
+"""
+import ingredient_ids as ids
+import pandas as pd
+import os
+import tempfile
+
+
+def test_normalize_ingredient():
+    """
+    Test the normalize_ingredient function
+    """
+    print('Testing normalize_ingredient():')
+    print(ids.normalize_ingredient('Vitis Vinifera(Grape) Seed Oil'))
+    # vitis vinifera seed oil
+    print(ids.normalize_ingredient('PEG-20 Glyceryl Trii-sostearate'))
+    # peg20 glyceryl triisostearate
+    print(ids.normalize_ingredient('(Aqua)'))  # aqua
+    print(ids.match_text('Camellia Sinensis (Green Tea) Leaf Extract'))
+    # camellia sinensis green tea leaf extract
+
+
+def test_get_id():
+    """
+    Test that spellings of the same ingredient share an ID and different 
+    ingredients don't
+    """
+    print('Testing get_id():')
+    ingredient_dict = ids.IngredientDictionary()
+    same = ['Olea Europaea (Olive) Fruit Oil', 'OleaEuropaea Fruit Oil',
+            'olea europaea fruit oil', 'Ceramide 3', 'Ceramide3',
+            'Glycerin', 'Glycerine']
+    print([ingredient_dict.get_id(name) for name in same])
+    # [0, 0, 0, 1, 1, 2, 2]
+
+    different = ['Linoleic Acid', 'Linolenic Acid', 'Pearl Extract',
+                 'Pear Extract', 'Polyglyceryl-3 Stearate',
+                 'Polyglyceryl-3 Distearate']
+    different_ids = [ingredient_dict.get_id(name) for name in different]
+    print(len(set(different_ids)) == len(different))  # True
+    print(ingredient_dict.get_id('Unknown Extract', add=False))  # -1
+    print(ingredient_dict.get_id('GLYCERINE ', add=False))  # 2
+    print(len(ingredient_dict.raw_ids))  # 13
+
+
+def test_encode():
+    """
+    Test the encode function, including missing names
+    """
+    print('Testing encode():')
+    ingredient_dict = ids.IngredientDictionary()
+    print(ingredient_dict.encode(pd.Series(['Water', None, 'Glycerin', 
+                                            'Water'])))  # [ 0 -1  1  0]
+
+
+def test_feature_builder():
+    """
+    Test that a misspelling of one ingredient doesn't flag the correctly 
+    spelled ingredient as another, and that parenthetical synonyms match
+    """
+    print('Testing IngredientFeatureBuilder:')
+    builder = ids.IngredientFeatureBuilder(ids.IngredientDictionary())
+    df = pd.DataFrame({
+        'sku': ['sku-0', 'sku-1', 'sku-2'],
+        'ingredients': [
+            'Water, Sodium Acrylate/Sodium Acryloyldimethyl Taureate Copolymer',
+            'Water, Urea',
+            'Water, Camellia Sinensis (Green Tea) Leaf Extract']})
+    df, _ = builder.build(df, quarantine=False)
+    print(list(df['contains_urea']))  # [False, True, False]
+    print(list(df['contains_green_tea']))  # [False, False, True]
+
+    # request names are matched without growing the dictionary
+    texts = len(builder.ingredient_dict.match_texts)
+    columns = builder.feature_columns
+    for name in ['Niacinamide (Vitamin B3)', 'Camellia Sinensis Leaf Extract',
+                 'Green Tea Water']:
+        row = builder.match_features(name)
+        print([columns[j] for j in range(len(columns)) if row[j]])
+    # ['contains_niacinamide', 'star']
+    # ['contains_green_tea', 'star'] (same ID as the green tea spelling)
+    # ['contains_green_tea', 'star']
+    print(len(builder.ingredient_dict.match_texts) == texts)  # True
+
+
+def test_save_load():
+    """
+    Test that a saved dictionary is loaded with the same IDs
+    """
+    print('Testing save() and load():')
+    ingredient_dict = ids.IngredientDictionary()
+    ingredient_dict.encode(pd.Series(['Water', 'Glycerin', 'Urea']))
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, 'ingredient_ids.json')
+        ingredient_dict.save(file_path)
+        loaded = ids.IngredientDictionary.load(file_path)
+    print([loaded.get_id(name, add=False) 
+           for name in ['Water', 'glycerin', 'Urea']])  # [0, 1, 2]
+
+
+def main():
+    test_normalize_ingredient()
+    test_get_id()
+    test_encode()
+    test_feature_builder()
+    test_save_load()
+
+
+if __name__ == '__main__':
+    main()
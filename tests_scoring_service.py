@@ -0,0 +1,199 @@
+"""
+Tests the rating scoring service's validation, scorer and micro-batching
+"""
+import scoring_service as svc
+import classification as clf
+import ingredient_ids as ids
+import asyncio
+import os
+import pandas as pd
+import tempfile
+from sklearn.ensemble import RandomForestClassifier
+
+
+def make_products():
+    """
+    Returns a list of small raw product dicts
+    """
+    return [
+        {'product_name': 'Toner', 'brand': 'COSRX', 'price': '18.5',
+         'ingredients': 'Water, Niacinamide, Glycerin, Butylene Glycol'},
+        {'product_name': 'Serum', 'brand': 'Klairs', 'price': 23,
+         'ingredients': 'Water, Ascorbic Acid, Centella Asiatica Extract'},
+        {'product_name': 'Cream', 'brand': 'COSRX', 'price': 25,
+         'ingredients': 'Water, Ceramide NP, Hyaluronic Acid, Glycerin'},
+        {'product_name': 'Oil', 'brand': 'Klairs', 'price': 30,
+         'ingredients': 'Squalane, Tocopherol, Rosehip Oil'},
+    ]
+
+
+def test_validate_product():
+    """
+    Test that validate_product casts prices and rejects unscorable products
+    """
+    print('Testing validate_product():')
+    product = svc.validate_product(make_products()[0])
+    print(product['price'], product['rating_count'])  # 18.5 0
+
+    bad_products = [[], {'brand': 'COSRX'}, {'ingredients': '  '},
+                    {'ingredients': 'Water', 'price': 'free'},
+                    {'ingredients': 'Water', 'price': 'nan'},
+                    {'ingredients': 'Water', 'price': None},
+                    {'ingredients': 'Water', 'brand': ['COSRX']},
+                    {'ingredients': 'Water', 'rating_count': 1e400},
+                    {'ingredients': 'Water', 'price': 10 ** 400}]
+    rejected = 0
+    for bad_product in bad_products:
+        try:
+            svc.validate_product(bad_product)
+        except (ValueError, TypeError):
+            rejected = rejected + 1
+    print(rejected == len(bad_products))  # True
+
+
+def test_rating_scorer():
+    """
+    Test that the scorer predicts like the model it loads, including for a
+    brand unseen in training
+    """
+    print('Testing RatingScorer:')
+    products = make_products()
+    builder = ids.IngredientFeatureBuilder(ids.IngredientDictionary())
+    df, _ = builder.build(pd.DataFrame(
+        [svc.validate_product(product) for product in products]).assign(
+            sku=['sku-' + str(i) for i in range(len(products))]),
+        quarantine=False)
+    features = pd.get_dummies(
+        df.drop(columns=['product_name', 'sku', 'ingredients']))
+    model = RandomForestClassifier(n_estimators=5, random_state=0)
+    model.fit(features, ['High', 'Low', 'High', 'Average'])
+
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = os.path.join(directory, 'rating_model.pkl')
+        clf.save_model(model, model_path)
+        scorer = svc.RatingScorer(
+            model_path, os.path.join(directory, 'ingredient_ids.json'))
+        print(scorer.score(products) == list(model.predict(features)))
+        # True
+        print((scorer.make_features(products) == features.to_numpy(
+            dtype='float32')).all())  # True
+        # request ingredients are looked up without growing the dictionary
+        raw_ids = scorer.builder.ingredient_dict.raw_ids
+        id_count = len(raw_ids)
+        unseen = dict(products[0], brand='Unseen Brand',
+                      ingredients='Water, Unseen Niacinamide Extract')
+        print(len(scorer.score([unseen])))  # 1
+        print(len(raw_ids) == id_count)  # True
+
+
+class CountingScorer:
+    """
+    Stands in for RatingScorer and records the size of each scored batch
+    """
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def score(self, products):
+        self.batch_sizes.append(len(products))
+        return [product['brand'] for product in products]
+
+
+def test_micro_batcher():
+    """
+    Test that concurrent products are scored in one batch and that an invalid
+    product is rejected without being queued
+    """
+    print('Testing MicroBatcher:')
+
+    async def submit_all(batcher, products):
+        batch_task = asyncio.ensure_future(batcher.run())
+        results = await asyncio.gather(
+            *[batcher.submit(product) for product in products],
+            return_exceptions=True)
+        batch_task.cancel()
+        return results
+
+    scorer = CountingScorer()
+    batcher = svc.MicroBatcher(scorer, max_batch_size=64, max_wait=0.05)
+    products = make_products() + [{'brand': 'COSRX'}]
+    results = asyncio.run(submit_all(batcher, products))
+    print(results[:4])  # ['COSRX', 'Klairs', 'COSRX', 'Klairs']
+    print(type(results[4]).__name__)  # ValueError
+    print(scorer.batch_sizes)  # [4]
+    batcher.executor.shutdown()
+
+
+class RecordingWriter:
+    """
+    Stands in for an asyncio StreamWriter and keeps the written bytes
+    """
+
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data = self.data + data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_handle_connection():
+    """
+    Test that malformed requests get a 400 response instead of an error, and
+    that the connection is closed after a malformed request
+    """
+    print('Testing handle_connection():')
+
+    async def respond(request):
+        reader = asyncio.StreamReader()
+        reader.feed_data(request)
+        reader.feed_eof()
+        writer = RecordingWriter()
+        batcher = svc.MicroBatcher(CountingScorer(), max_wait=0.01)
+        batch_task = asyncio.ensure_future(batcher.run())
+        await svc.handle_connection(batcher, reader, writer)
+        batch_task.cancel()
+        batcher.executor.shutdown()
+        return writer
+
+    def post(body, content_length=None):
+        if content_length is None:
+            content_length = str(len(body))
+        return (b'POST /predict HTTP/1.1\r\nContent-Length: '
+                + content_length.encode() + b'\r\n\r\n' + body)
+
+    product = b'{"ingredients": "Water", "brand": "COSRX"}'
+    writer = asyncio.run(respond(post(product) + post(product)))
+    print(writer.data.count(b'HTTP/1.1 200 OK'))  # 2
+    print(writer.data.endswith(b'{"rating_bin": "COSRX"}'))  # True
+
+    bad_requests = [b'GARBAGE\r\n\r\n',
+                    b'GET /health HTTP/1.1\r\nno colon\r\n\r\n',
+                    post(product, 'ten'), post(product, '-5'),
+                    post(product, str(svc.MAX_BODY_SIZE + 1)),
+                    post(b'{"ingredients": "Water", "rating_count": 1e400}'),
+                    post(b'[' * 100000)]
+    responses = [asyncio.run(respond(request + post(product))).data
+                 for request in bad_requests]
+    print([data.count(b'400 Bad Request') for data in responses])
+    # [1, 1, 1, 1, 1, 1, 1]
+    # malformed HTTP closes the connection, an invalid product doesn't
+    print([data.count(b'200 OK') for data in responses])
+    # [0, 0, 0, 0, 0, 1, 1]
+
+
+def main():
+    test_validate_product()
+    test_rating_scorer()
+    test_micro_batcher()
+    test_handle_connection()
+
+
+if __name__ == '__main__':
+    main()
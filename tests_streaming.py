@@ -0,0 +1,111 @@
+"""
+Tests the streaming mode of the pipeline
+"""
+import streaming
+import ingredient_ids as ids
+import os
+import pandas as pd
+import tempfile
+
+
+def make_records():
+    """
+    Returns a list of small scraped product records, with the second product
+    listed under two subcategories
+    """
+    records = []
+    for i, ingredients in enumerate([
+            'Water, Niacinamide, Glycerin', 'Water, Ceramide NP, Panthenol',
+            'Water, Hyaluronic Acid', 'Squalane, Tocopherol']):
+        records.append({'product_name': 'Product ' + str(i),
+                        'sku': 'sku-' + str(i), 'brand': 'COSRX',
+                        'subcategory': 'Toners', 'price': 20.0,
+                        'rating': 4.5, 'rating_count': 10,
+                        'ingredients': ingredients})
+    records.append(dict(records[1], subcategory='Serums'))
+    return records
+
+
+def test_threaded():
+    """
+    Test that items pass through in order and that an error in the producer
+    thread is raised in the consumer
+    """
+    print('Testing threaded():')
+    print(list(streaming.threaded(range(5), maxsize=2)))  # [0, 1, 2, 3, 4]
+
+    def failing_items():
+        yield 1
+        raise RuntimeError('scrape failed')
+
+    received = []
+    try:
+        for item in streaming.threaded(failing_items()):
+            received.append(item)
+    except RuntimeError as error:
+        print(received, error)  # [1] scrape failed
+
+
+def test_batch_records():
+    """
+    Test the batch_records function
+    """
+    print('Testing batch_records():')
+    print([len(chunk) for chunk in streaming.batch_records(range(7), 3)])
+    # [3, 3, 1]
+
+
+def test_process_chunks():
+    """
+    Test that streamed chunks give the same products as building the features
+    all at once, with each sku added to the junction table once
+    """
+    print('Testing process_chunks() and write_chunks():')
+    with tempfile.TemporaryDirectory() as directory:
+        data_path = os.path.join(directory, 'processed_data.csv')
+        junction_path = os.path.join(directory, 'junction_table.csv')
+        dictionary_path = os.path.join(directory, 'ingredient_ids.json')
+        chunks = streaming.batch_records(iter(make_records()), 2)
+        product_count = streaming.write_chunks(
+            streaming.process_chunks(chunks, dictionary_path=dictionary_path),
+            data_path, junction_path)
+        streamed = pd.read_csv(data_path)
+        junction_table = pd.read_csv(junction_path)
+
+    builder = ids.IngredientFeatureBuilder(ids.IngredientDictionary())
+    df, _ = builder.build(pd.DataFrame(make_records()))
+    print(product_count)  # 5
+    print(list(streamed.columns) == list(df.columns))  # True
+    print(list(streamed['ingredient_counts']))  # [3, 3, 2, 2, 3]
+    print(list(streamed['ingredient_counts']) 
+          == list(df['ingredient_counts']))  # True
+    print(junction_table.groupby('sku').size().tolist())  # [3, 3, 2, 2]
+
+
+def test_stage_errors():
+    """
+    Test that an error in the cleaning stage's thread reaches the caller of 
+    process_chunks
+    """
+    print('Testing process_chunks() errors:')
+    chunks = [make_records()[:2], [{'sku': 'sku-9', 'brand': 'COSRX'}]]
+    received = []
+    with tempfile.TemporaryDirectory() as directory:
+        dictionary_path = os.path.join(directory, 'ingredient_ids.json')
+        try:
+            for df, _ in streaming.process_chunks(
+                    iter(chunks), dictionary_path=dictionary_path):
+                received.append(len(df.index))
+        except KeyError as error:
+            print(received, error)  # [2] 'ingredients'
+
+
+def main():
+    test_threaded()
+    test_batch_records()
+    test_process_chunks()
+    test_stage_errors()
+
+
+if __name__ == '__main__':
+    main()
@@ -91,19 +91,25 @@ def make_category_df(urls):
     website. Dataframe is in tidy format.
     Note: Ingredients are in a comma seperated string
     """
-    category_rows = []
-    for product_page in urls:
-        page = requests.get(product_page)
-        soup = BeautifulSoup(page.content, 'html.parser')
-        
-        product_info = get_product_info(soup)
-        category_rows.append(product_info)
-       
+    category_rows = list(iter_category_products(urls))
     category_df = pd.DataFrame(category_rows)
 
     return category_df
 
 
+def iter_category_products(urls):
+    """
+    Yields the product info and ingredients of each product in a given list of 
+    URLs of product pages on the Soko Glam website as soon as its page is 
+    scraped
+    Note: Ingredients are in a comma seperated string
+    """
+    for product_page in urls:
+        page = requests.get(product_page)
+        soup = BeautifulSoup(page.content, 'html.parser')
+        yield get_product_info(soup)
+
+
 def get_catgories_dict():
     """
     Returns a dictionary of subcategories for skincare for Soko Glam's menu.
@@ -123,10 +129,10 @@ def get_catgories_dict():
     return category_dict
 
 
-def add_category(df):
+def make_categories_dict():
     """
-    Adds a category column to the given dataframe using the subcategories and 
-    returns the new df
+    Returns a dict with Soko Glam's skincare subcategories as keys and the 
+    category each belongs to as values
     """
     categories = {
         'Cleansing Balms': 'Double-Cleanse', 'Oil Cleansers': 'Double-Cleanse', 
@@ -141,24 +147,58 @@ def add_category(df):
         'Facial Moisturizer': 'Moisturizers', 
         'Facial Mist & Oil': 'Moisturizers', 'Sunscreen': 'Sun Protection', 
         'Makeup & SPF': 'Sun Protection'}
-    df['category'] = df['subcategory'].map(categories)
+    return categories
+
+
+def add_category(df):
+    """
+    Adds a category column to the given dataframe using the subcategories and 
+    returns the new df
+    """
+    df['category'] = df['subcategory'].map(make_categories_dict())
     return df
 
 
+def get_category_url(dictionary, category):
+    """
+    Returns the full URL of the given category in the dictionary of URL 
+    extensions
+    """
+    if category == 'Facial Mist & Oil':  # Facial Mist & Oil already has https://sokoglam.com/ in given url
+        return dictionary[category]
+    return 'https://sokoglam.com/' + dictionary[category]
+
+
+def iter_products(dictionary):
+    """
+    Yields a dict of the product data of every product in the desired 
+    categories on the Soko Glam website as soon as its page is scraped, with 
+    the same fields as the columns of the file make_data_file creates. Needs a 
+    dictionary of the URL extension for each category.
+    """
+    columns = ['product_name', 'brand', 'price', 'rating', 'rating_count', 
+               'sku', 'ingredients']
+    categories = make_categories_dict()
+
+    for category in dictionary.keys():
+        product_urls = get_category_urls(get_category_url(dictionary, category))
+        for product_info in iter_category_products(product_urls):
+            product = dict(zip(columns, product_info))
+            product['subcategory'] = category
+            product['category'] = categories.get(category)
+            yield product
+
+
 def make_data_file(dictionary):
     """
     Creates a pandas dataframe of product data for all the products in the
     desired categories on the Soko Glam website and saves it to a csv
     file. Needs a dictionary of the URL extension for each category.
     """
-    website_url = 'https://sokoglam.com/'
     big_df = pd.DataFrame()
 
     for category in dictionary.keys():
-        category_url = website_url + dictionary[category]
-        if category == 'Facial Mist & Oil':  # Facial Mist & Oil already has https://sokoglam.com/ in given url
-            category_url = dictionary[category]
-        product_urls = get_category_urls(category_url)
+        product_urls = get_category_urls(get_category_url(dictionary, category))
 
         category_df = make_category_df(product_urls)
         category_df['category'] = [category] * len(product_urls)